@@ -0,0 +1,199 @@
+"""MLT: Incremental download of price data.
+
+Instead of downloading the whole history of a symbol again, the dates
+missing from its CSV file are detected and only those gaps are fetched
+and appended to the file. Symbols missing the same range are fetched in
+one request. The data source is pluggable, so a local FrameSource can
+stand in for Yahoo! Finance.
+
+Refresh every CSV file in data/ up to today with:
+
+    python datasync.py [data_dir]
+"""
+import os
+import sys
+import pandas as pd
+import pandas.io.data
+
+from util import symbol_to_path, missing_bdays, atomic_write, MAX_MISSING_BDAYS
+
+
+class YahooSource(object):
+    """Daily prices from Yahoo! Finance."""
+
+    def fetch(self, symbols, start, end):
+        """Download prices of several symbols between start and end.
+
+        Returns
+        -------
+            prices: dictionary symbol -> DataFrame indexed by Date with the
+            Open, High, Low, Close, Volume and Adj Close columns
+        """
+        if len(symbols) == 1:
+            return {symbols[0]: pd.io.data.DataReader(symbols[0], 'yahoo', start, end)}
+
+        #Symbols that fail to download are dropped from the panel
+        panel = pd.io.data.DataReader(symbols, 'yahoo', start, end)
+        return dict((symbol, panel.minor_xs(symbol).dropna(how='all'))
+                    for symbol in panel.minor_axis)
+
+
+class FrameSource(object):
+    """Prices served from DataFrames in memory, for tests and offline use."""
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.requests = [] #(symbols, start, end) of each fetch call
+
+    def fetch(self, symbols, start, end):
+        """Return the prices of several symbols between start and end."""
+        self.requests.append((list(symbols), start, end))
+        return dict((symbol, self.frames[symbol].sort_index()[start:end])
+                    for symbol in symbols if symbol in self.frames)
+
+
+def missing_ranges(symbol, start, end, tolerance=0, base_dir=os.path.join(".", "data")):
+    """Date ranges between start and end that are not in the CSV file of a symbol.
+
+    Parameters
+    ----------
+        symbol: ticker symbol
+        start, end: date range that should be covered
+        tolerance: business days that may be missing at each end of the
+        range before it is reported (e.g. holidays)
+        base_dir: directory with the CSV files
+
+    Returns
+    -------
+        ranges: list of (start, end) missing ranges
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    csv_file = symbol_to_path(symbol, base_dir)
+    if start > end:
+        return []
+    if not os.path.isfile(csv_file):
+        return [(start, end)]
+
+    dates = pd.read_csv(csv_file, index_col='Date', parse_dates=True, usecols=['Date']).index
+    dates = dates[(dates >= start) & (dates <= end)].sort_values()
+    if len(dates) == 0:
+        return [(start, end)]
+
+    one_day = pd.Timedelta(days=1)
+    ranges = []
+    if missing_bdays(start, dates[0] - one_day) > tolerance:
+        ranges.append((start, dates[0] - one_day))
+
+    #Holes in the middle of the file longer than a holiday weekend
+    for before, after in zip(dates[:-1], dates[1:]):
+        if missing_bdays(before + one_day, after - one_day) > MAX_MISSING_BDAYS:
+            ranges.append((before + one_day, after - one_day))
+
+    if missing_bdays(dates[-1] + one_day, end) > tolerance:
+        ranges.append((dates[-1] + one_day, end))
+    return ranges
+
+
+def append_prices(symbol, prices, base_dir=os.path.join(".", "data")):
+    """Merge new prices into the CSV file of a symbol, atomically.
+
+    New rows replace existing rows with the same date. The file keeps its
+    date ordering (Yahoo! files are sorted newest first). It is written to
+    a temporary file that then replaces the original, so readers never
+    see a partially written file.
+    """
+    csv_file = symbol_to_path(symbol, base_dir)
+    descending = False
+    if os.path.isfile(csv_file):
+        current = pd.read_csv(csv_file, index_col='Date', parse_dates=True, na_values=['nan'])
+        descending = len(current) > 1 and current.index[0] > current.index[-1]
+        prices = pd.concat([current, prices])
+    prices = prices[~prices.index.duplicated(keep='last')].sort_index(ascending=not descending)
+    prices.index.name = 'Date'
+
+    atomic_write(csv_file, prices.to_csv, suffix=".csv")
+
+
+def fetch_gaps(gaps, source=None, base_dir=os.path.join(".", "data")):
+    """Fetch missing date ranges and append them to the CSV files.
+
+    Parameters
+    ----------
+        gaps: dictionary symbol -> list of (start, end) missing ranges
+        source: object with a fetch(symbols, start, end) method
+        (default: YahooSource)
+        base_dir: directory with the CSV files
+
+    Returns
+    -------
+        fetched: dictionary symbol -> list of (start, end) ranges fetched
+    """
+    if source is None:
+        source = YahooSource()
+
+    #Symbols missing the same range are fetched together
+    batches = {}
+    for symbol, ranges in gaps.items():
+        for gap in ranges:
+            batches.setdefault(gap, []).append(symbol)
+
+    fetched = {}
+    new_prices = {}
+    for (gap_start, gap_end), batch in sorted(batches.items()):
+        for symbol, prices in source.fetch(sorted(batch), gap_start, gap_end).items():
+            if len(prices) > 0:
+                new_prices.setdefault(symbol, []).append(prices)
+            fetched.setdefault(symbol, []).append((gap_start, gap_end))
+
+    #One write per symbol, whatever the number of gaps
+    for symbol, frames in new_prices.items():
+        append_prices(symbol, pd.concat(frames), base_dir)
+
+    return fetched
+
+
+def sync_symbols(symbols, start, end, source=None, tolerance=0, base_dir=os.path.join(".", "data")):
+    """Download the prices missing from the CSV files of several symbols.
+
+    Parameters
+    ----------
+        symbols: ticker symbols to synchronize
+        start, end: date range the files should cover
+        source: data source (default: YahooSource)
+        tolerance: business days that may be missing at each end of the range
+        base_dir: directory with the CSV files
+
+    Returns
+    -------
+        fetched: dictionary symbol -> list of (start, end) ranges fetched
+    """
+    gaps = dict((symbol, missing_ranges(symbol, start, end, tolerance, base_dir))
+                for symbol in symbols)
+    return fetch_gaps(gaps, source, base_dir)
+
+
+def refresh_all(end=None, source=None, base_dir=os.path.join(".", "data")):
+    """Extend every price CSV file in base_dir up to end (default: today)."""
+    if end is None:
+        end = pd.Timestamp.today().normalize()
+
+    #Each file is checked from its own first date
+    gaps = {}
+    for csv_name in sorted(os.listdir(base_dir)):
+        csv_file = os.path.join(base_dir, csv_name)
+        if not csv_name.endswith(".csv") or \
+                'Date' not in pd.read_csv(csv_file, nrows=0).columns:
+            continue
+        symbol = csv_name[:-4]
+        dates = pd.read_csv(csv_file, index_col='Date', parse_dates=True, usecols=['Date']).index
+        if len(dates) > 0:
+            gaps[symbol] = missing_ranges(symbol, dates.min(), end, base_dir=base_dir)
+
+    return fetch_gaps(gaps, source, base_dir)
+
+
+if __name__ == "__main__":
+    base_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(".", "data")
+    fetched = refresh_all(base_dir=base_dir)
+    for symbol in sorted(fetched):
+        print symbol, ", ".join("{} to {}".format(s.date(), e.date()) for s, e in fetched[symbol])
@@ -6,15 +6,18 @@ Created on Wed Feb 24 17:59:24 2016
 
 import numpy as np
 import pandas as pd
+from indicators.RollingWindow import RollingWindow
 
 class Bollinger():
     
     def __init__(self, window_length = 20, dev_factor=2):
         self.window = window_length
         self.dev = dev_factor
+        self.stream = None
     
     def addPriceSeries(self, historical):
         self.historical = historical
+        self.stream = None
         
     def getIndicator(self):
         #Compute rolling mean and std    
@@ -27,6 +30,27 @@ class Bollinger():
         #Rename dataframe
         return bollinger_ind.rename( columns=lambda x: "Bollinger_" + x)
         
+    def startStream(self, symbols):
+        #Rolling state, continuing the price series if any
+        self.stream = RollingWindow(self.window, len(symbols))
+        if hasattr(self, "historical"):
+            for values in self.historical[list(symbols)].values[-self.window:]:
+                self.stream.push(values)
+        
+    def addPrice(self, prices):
+        """
+        @summary: Streaming update with a new bar, in constant time
+        @param prices: Series of the prices of the bar, indexed by symbol
+        @returns the indicator of the bar, as the matching row of getIndicator
+        """
+        if self.stream is None:
+            self.startStream(prices.index)
+        values = prices.values.astype(float)
+        self.stream.push(values)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            bollinger_ind = (values - self.stream.mean()) / ( 2 * self.stream.std())
+        return pd.Series(bollinger_ind, index = ["Bollinger_" + x for x in prices.index], name = prices.name)
+        
         
 def test_run():
     """Driver function."""
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Memoization of indicator results.
+
+Results are keyed by indicator, parameters, symbol, date range and a
+fingerprint of the prices they were computed from, so a change in the
+data is a miss. A bounded memory tier is backed by an optional on-disk
+tier shared between runs.
+"""
+
+import copy
+import hashlib
+import os
+from collections import OrderedDict
+
+import pandas as pd
+
+from util import LRUCache, atomic_write
+
+class IndicatorCache(LRUCache):
+    """Two tier cache of indicator results.
+
+    The memory tier keeps the most recently used results up to max_bytes.
+    If cache_dir is set, results are also pickled in it, one file per key,
+    and the least recently used files are removed above max_disk_bytes.
+    The size and use order of the files are read from the directory once,
+    then kept up to date in memory.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 ** 2, cache_dir=None, max_disk_bytes=1024 ** 3):
+        LRUCache.__init__(self, max_bytes)
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_hits = 0
+        self.disk_entries = None #key -> file size, least recently used first
+        self.disk_bytes = 0
+
+    def get_indicator(self, indicator, prices):
+        """Return indicator.getIndicator() on prices, only computing the symbols
+        that are not cached.
+
+        Parameters
+        ----------
+            indicator: Bollinger, Momentum or Volatility instance
+            prices: DataFrame of prices, one column per symbol
+
+        Returns
+        -------
+            indicator: DataFrame as returned by getIndicator
+        """
+        params = sorted((name, value) for name, value in vars(indicator).items()
+                        if isinstance(value, (int, long, float, str, bool)))
+
+        def compute(missing):
+            #Work on a copy, the prices given to the indicator are left untouched
+            instance = copy.copy(indicator)
+            instance.addPriceSeries(missing)
+            return instance.getIndicator()
+
+        return self.get(indicator.__class__.__name__, params, prices, compute)
+
+    def get(self, name, params, prices, compute):
+        """Return compute(prices), from the cache when possible.
+
+        Parameters
+        ----------
+            name, params: identify the computation, params must have a stable repr
+            prices: Series, or DataFrame whose columns are computed independently
+            compute: function of the prices. For a DataFrame it must return one
+            column per price column, in the same order.
+
+        Returns
+        -------
+            result: a copy of the cached result, so it can be modified
+        """
+        if isinstance(prices, pd.Series):
+            key = result_key(name, params, prices)
+            result = self.lookup(key)
+            if result is None:
+                result = compute(prices)
+                self.store(key, result)
+            return result.copy()
+
+        if prices.shape[1] == 0:
+            return compute(prices)
+
+        keys = [result_key(name, params, prices.iloc[:, i]) for i in range(prices.shape[1])]
+        results = [self.lookup(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            computed = compute(prices.iloc[:, missing])
+            for j, i in enumerate(missing):
+                results[i] = computed.iloc[:, j].copy()
+                self.store(keys[i], results[i])
+        return pd.concat(results, axis=1)
+
+    def lookup(self, key):
+        """Return the cached result of a key, or None."""
+        if key in self.entries:
+            self.hits += 1
+            return self.touch(key)
+
+        path = self.disk_path(key)
+        if path is not None and os.path.exists(path):
+            try:
+                result = pd.read_pickle(path)
+            except Exception:
+                result = None #Partially written or corrupted, computed again
+            if result is not None:
+                self.disk_hits += 1
+                os.utime(path, None) #Recently used, evicted last
+                self.disk_remember(key, path)
+                self.remember(key, result)
+                self.evict()
+                return result
+
+        self.misses += 1
+        return None
+
+    def store(self, key, result):
+        """Cache the result of a key in memory and on disk."""
+        self.remember(key, result)
+        self.evict()
+        path = self.disk_path(key)
+        if path is None:
+            return
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        atomic_write(path, result.to_pickle)
+        self.disk_remember(key, path)
+        self.evict_disk()
+
+    def load_disk_entries(self):
+        """Read the size and use order of the files of the disk tier, once."""
+        if self.disk_entries is not None:
+            return
+        files = []
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".pkl"):
+                    path = os.path.join(self.cache_dir, name)
+                    files.append((os.path.getmtime(path), name[:-4], os.path.getsize(path)))
+        self.disk_entries = OrderedDict((key, size) for _, key, size in sorted(files))
+        self.disk_bytes = sum(self.disk_entries.values())
+
+    def disk_remember(self, key, path):
+        """Record a file of the disk tier as most recently used."""
+        self.load_disk_entries()
+        self.disk_bytes -= self.disk_entries.pop(key, 0)
+        self.disk_entries[key] = os.path.getsize(path)
+        self.disk_bytes += self.disk_entries[key]
+
+    def evict_disk(self):
+        """Remove least recently used files until within max_disk_bytes."""
+        while self.disk_bytes > self.max_disk_bytes and len(self.disk_entries) > 1:
+            key, size = self.disk_entries.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(self.disk_path(key))
+            except OSError:
+                pass #Already removed by another process
+
+    def disk_path(self, key):
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    def clear(self):
+        """Drop the memory tier and reset the counters, the disk tier is kept."""
+        LRUCache.clear(self)
+        self.disk_hits = 0
+
+    def cache_info(self):
+        """Return hits (memory and disk), misses, cached results and memory use."""
+        info = LRUCache.cache_info(self)
+        info.update({"disk_hits": self.disk_hits, "results": len(self.entries)})
+        return info
+
+
+def fingerprint(prices):
+    """Hash of the values and dates of a Series, changes with the data."""
+    digest = hashlib.sha1(prices.values.astype(float).tobytes())
+    digest.update(prices.index.values.tobytes())
+    return digest.hexdigest()
+
+
+def result_key(name, params, prices):
+    """Key of the result of a computation on the prices of one symbol."""
+    start = prices.index[0] if len(prices) else None
+    end = prices.index[-1] if len(prices) else None
+    key = (name, params, prices.name, str(start), str(end), fingerprint(prices))
+    return hashlib.sha1(repr(key)).hexdigest()
+
+
+#Cache shared by the strategies, memory only unless cache_dir is set
+indicator_cache = IndicatorCache()
@@ -6,15 +6,18 @@ Created on Wed Feb 24 17:59:24 2016
 
 import numpy as np
 import pandas as pd
+from indicators.RollingWindow import RollingWindow
 
 
 class Momentum():
     
     def __init__(self, window_length = 5):
         self.window = window_length
+        self.stream = None
     
     def addPriceSeries(self, historical):
         self.historical = historical
+        self.stream = None
         
     def getIndicator(self):
         momentum = self.historical / self.historical.shift( self.window ) - 1
@@ -22,6 +25,28 @@ class Momentum():
         #Rename dataframe
         return momentum.rename( columns=lambda x: "Momentum_" + x)
         
+    def startStream(self, symbols):
+        #Last window prices, continuing the price series if any
+        self.stream = RollingWindow(self.window, len(symbols))
+        if hasattr(self, "historical"):
+            for values in self.historical[list(symbols)].values[-self.window:]:
+                self.stream.push(values)
+        
+    def addPrice(self, prices):
+        """
+        @summary: Streaming update with a new bar, in constant time
+        @param prices: Series of the prices of the bar, indexed by symbol
+        @returns the indicator of the bar, as the matching row of getIndicator
+        """
+        if self.stream is None:
+            self.startStream(prices.index)
+        values = prices.values.astype(float)
+        #The price leaving the window is the one window bars before
+        previous = self.stream.push(values)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            momentum = values / previous - 1
+        return pd.Series(momentum, index = ["Momentum_" + x for x in prices.index], name = prices.name)
+        
         
         
 def test_run():
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Compute several indicators over the same prices in one pass.
+
+The indicators share their intermediate results: the price and return
+arrays, and the cumulative sums (of values, squares and missing values)
+from which every rolling mean and standard deviation is derived, whatever
+its window.
+"""
+
+import copy
+import numpy as np
+import pandas as pd
+
+from indicators.Bollinger import Bollinger
+from indicators.Momentum import Momentum
+from indicators.Volatility import Volatility
+
+def cumsum0(values):
+    """Cumulative sum along the dates, with a row of zeros first"""
+    sums = np.zeros((values.shape[0] + 1,) + values.shape[1:])
+    np.cumsum(values, axis = 0, out = sums[1:])
+    return sums
+
+def window_diff(sums, window):
+    """Sums over the windows ending at each date, from cumsum0"""
+    return sums[window:] - sums[:-window]
+
+def bollinger(pipeline, indicator):
+    ma, sd = pipeline.rolling("prices", indicator.window)
+    return (pipeline.prices - ma) / ( 2 * sd)
+
+def momentum(pipeline, indicator):
+    return pipeline.ratio(indicator.window) - 1
+
+def volatility(pipeline, indicator):
+    ma, sd = pipeline.rolling("returns", indicator.window)
+    return sd * np.sqrt(255)
+
+#Computation and column prefix of each indicator class
+COMPUTE = {Bollinger: (bollinger, "Bollinger_"),
+           Momentum: (momentum, "Momentum_"),
+           Volatility: (volatility, "Volatility_")}
+
+class Pipeline():
+
+    def __init__(self, indicators):
+        """
+        @param indicators: list of indicator instances (Bollinger, Momentum,
+        Volatility), their columns appear in this order in the features
+        """
+        self.indicators = indicators
+
+    def addPriceSeries(self, historical):
+        self.historical = historical
+        self.prices = historical.values.astype(float)
+        self.series = {"prices": self.prices}
+        self.sums = {}
+
+    def returns(self):
+        """Daily returns, computed once"""
+        if "returns" not in self.series:
+            returns = np.empty(self.prices.shape) * np.nan
+            returns[1:] = self.prices[1:] / self.prices[:-1] - 1
+            self.series["returns"] = returns
+        return self.series["returns"]
+
+    def ratio(self, window):
+        """Price divided by the price window dates before"""
+        ratio = np.empty(self.prices.shape) * np.nan
+        if window < self.prices.shape[0]:
+            ratio[window:] = self.prices[window:] / self.prices[:self.prices.shape[0] - window]
+        return ratio
+
+    def rolling(self, name, window):
+        """
+        @summary: Rolling mean and standard deviation (ddof 1) of a series, NaN
+        when the window is incomplete or holds a missing value, as pd.rolling_mean
+        and pd.rolling_std
+        @param name: "prices" or "returns"
+        """
+        if name not in self.sums:
+            values = self.returns() if name == "returns" else self.series[name]
+            missing = np.isnan(values)
+            #Values are centered on their column mean, limiting the cancellation
+            #errors of the sums of squares
+            counts = np.maximum((~missing).sum(axis = 0), 1)
+            center = np.where(missing, 0, values).sum(axis = 0) / counts
+            centered = np.where(missing, 0, values - center)
+            self.sums[name] = (center, cumsum0(missing), cumsum0(centered), cumsum0(centered ** 2))
+        center, missing, sum1, sum2 = self.sums[name]
+
+        mean = np.empty(self.prices.shape) * np.nan
+        std = np.empty(self.prices.shape) * np.nan
+        if window > self.prices.shape[0]:
+            return mean, std
+
+        valid = window_diff(missing, window) == 0
+        s1 = window_diff(sum1, window)
+        s2 = window_diff(sum2, window)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            var = np.maximum(s2 - s1 * s1 / window, 0) / (window - 1)
+            mean[window - 1:] = np.where(valid, s1 / window + center, np.nan)
+            std[window - 1:] = np.where(valid & (window > 1), np.sqrt(var), np.nan)
+        return mean, std
+
+    def getFeatures(self):
+        """
+        @summary: Compute all the indicators
+        @returns a dataframe with one column per indicator and symbol
+        """
+        blocks = []
+        columns = []
+        for indicator in self.indicators:
+            compute, prefix = COMPUTE[indicator.__class__]
+            with np.errstate(divide = "ignore", invalid = "ignore"):
+                blocks.append( compute(self, indicator) )
+            columns.extend( prefix + str(c) for c in self.historical.columns )
+        return pd.DataFrame(np.hstack(blocks), index = self.historical.index, columns = columns)
+
+    def getGrid(self, indicator, windows):
+        """
+        @summary: Compute an indicator for several windows, for parameter sweeps.
+        All the windows are derived from the same cumulative sums.
+        @param indicator: indicator instance, its window is replaced by each of windows
+        @param windows: list of window lengths
+        @returns numpy array of shape (windows, dates, symbols)
+        """
+        compute, prefix = COMPUTE[indicator.__class__]
+        grid = np.empty((len(windows),) + self.prices.shape)
+        for i, window in enumerate(windows):
+            instance = copy.copy(indicator)
+            instance.window = window
+            with np.errstate(divide = "ignore", invalid = "ignore"):
+                grid[i] = compute(self, instance)
+        return grid
+
+
+def test_run():
+    """Driver function."""
+    from util import get_data
+
+    # Define input parameters
+    start_date = '2007-12-31'
+    end_date = '2009-12-31'
+    stock_symbol = ["IBM", "AAPL", "GE", "GLD", "SPY"]
+
+    #Get stock quotation
+    dates =  pd.date_range(start_date, end_date)
+    stock_prices = get_data(stock_symbol, dates, addSPY=False)
+
+    pipeline = Pipeline([ Bollinger(), Momentum(), Volatility() ])
+    pipeline.addPriceSeries( stock_prices )
+
+    print pipeline.getFeatures()
+
+
+if __name__ == "__main__":
+    test_run()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Rolling window over a stream of price rows, for the streaming indicators.
+"""
+
+import numpy as np
+
+class RollingWindow():
+
+    def __init__(self, window, size):
+        """
+        @summary: Keep the last window rows in a ring buffer, with the running
+        mean and sum of squared deviations (Welford) of each column
+        @param window: number of rows of the window
+        @param size: number of columns (symbols)
+        """
+        self.window = window
+        self.buffer = np.empty((window, size)) * np.nan
+        self.position = 0 #Next row of the buffer to overwrite
+        self.filled = 0 #Number of rows pushed, up to window
+        self.count = np.zeros(size) #Non missing values in the window
+        self.mean_ = np.zeros(size)
+        self.m2 = np.zeros(size)
+
+    def push(self, values):
+        """
+        @summary: Add a row to the window, in constant time
+        @returns the row leaving the window, NaN while the window is not full
+        """
+        values = np.asarray(values, dtype = float)
+        old = self.buffer[self.position].copy()
+        if self.filled == self.window:
+            self._remove(old)
+        else:
+            self.filled += 1
+        self._add(values)
+        self.buffer[self.position] = values
+        self.position = (self.position + 1) % self.window
+        return old
+
+    def _add(self, values):
+        valid = ~np.isnan(values)
+        self.count[valid] += 1
+        delta = values[valid] - self.mean_[valid]
+        self.mean_[valid] += delta / self.count[valid]
+        self.m2[valid] += delta * (values[valid] - self.mean_[valid])
+
+    def _remove(self, values):
+        valid = ~np.isnan(values)
+        self.count[valid] -= 1
+        empty = valid & (self.count == 0)
+        update = valid & ~empty
+        delta = values[update] - self.mean_[update]
+        self.mean_[update] -= delta / self.count[update]
+        self.m2[update] -= delta * (values[update] - self.mean_[update])
+        self.mean_[empty] = 0
+        self.m2[empty] = 0
+
+    def complete(self):
+        """Columns whose window is full and has no missing value"""
+        return self.count == self.window
+
+    def mean(self):
+        """Mean of the window, NaN when incomplete as pd.rolling_mean"""
+        return np.where(self.complete(), self.mean_, np.nan)
+
+    def std(self):
+        """Standard deviation (ddof 1) of the window, NaN when incomplete as pd.rolling_std"""
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            std = np.sqrt(np.maximum(self.m2, 0) / (self.count - 1))
+        return np.where(self.complete() & (self.window > 1), std, np.nan)
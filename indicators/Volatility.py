@@ -6,15 +6,18 @@ Created on Wed Feb 24 17:59:24 2016
 
 import numpy as np
 import pandas as pd
+from indicators.RollingWindow import RollingWindow
 
 
 class Volatility():
     
     def __init__(self, window_length = 20):
         self.window = window_length
+        self.stream = None
     
     def addPriceSeries(self, historical):
         self.historical = historical
+        self.stream = None
         
     def getIndicator(self):
         returns_series = self.historical / self.historical.shift( 1 ) - 1
@@ -24,6 +27,31 @@ class Volatility():
         #Rename dataframe
         return std_series.rename( columns=lambda x: "Volatility_" + x)
         
+    def startStream(self, symbols):
+        #Rolling state of the returns and last price, continuing the price series if any
+        self.stream = RollingWindow(self.window, len(symbols))
+        self.last_price = np.empty(len(symbols)) * np.nan
+        if hasattr(self, "historical"):
+            for values in self.historical[list(symbols)].values[-(self.window + 1):]:
+                self.pushPrice(values)
+        
+    def pushPrice(self, values):
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            self.stream.push(values / self.last_price - 1)
+        self.last_price = values
+        
+    def addPrice(self, prices):
+        """
+        @summary: Streaming update with a new bar, in constant time
+        @param prices: Series of the prices of the bar, indexed by symbol
+        @returns the indicator of the bar, as the matching row of getIndicator
+        """
+        if self.stream is None:
+            self.startStream(prices.index)
+        self.pushPrice(prices.values.astype(float))
+        std_series = self.stream.std() * np.sqrt(255)
+        return pd.Series(std_series, index = ["Volatility_" + x for x in prices.index], name = prices.name)
+        
         
 def test_run():
     """Driver function."""
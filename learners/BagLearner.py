@@ -3,17 +3,105 @@ A simple wrapper for Bagging learning.
 """
 
 import numpy as np
+import multiprocessing
+from multiprocessing import sharedctypes
 import learners.KNNLearner as knn
 
+#Data shared with the worker processes, set by init_worker
+worker_data = {}
+
+def share_array(array):
+    """
+    @summary: Copy a numpy array into shared memory
+    @returns the raw shared buffer and the shape of the array
+    """
+    raw = sharedctypes.RawArray('d', int(np.prod(array.shape)))
+    np.frombuffer(raw).reshape(array.shape)[...] = array
+    return raw, array.shape
+
+def detach_data(learner):
+    """
+    @summary: Remove the shared training data from a learner, so it is not
+    copied when the learner is sent to another process
+    """
+    if hasattr(learner, "data_x"):
+        learner.data_x = learner.data_y = None
+
+def attach_data(learner, dataX, dataY):
+    """
+    @summary: Give back the shared training data to a detached learner
+    """
+    if hasattr(learner, "data_x"):
+        learner.data_x = dataX
+        learner.data_y = dataY
+
+def init_worker(shared, objects):
+    """
+    @summary: Initialize a worker process, done once per worker
+    @param shared: dictionary name -> (raw buffer, shape) of shared arrays
+    @param objects: dictionary name -> object copied to the worker
+    """
+    for name, (raw, shape) in shared.items():
+        worker_data[name] = np.frombuffer(raw).reshape(shape)
+    worker_data.update(objects)
+    if "path" in objects:
+        #Map the saved ensemble, the pages of its arrays are shared by all workers
+        from learners.Persistence import load_learner
+        worker_data["learners"] = load_learner(objects["path"]).learners
+    else:
+        for learner in worker_data.get("learners", []):
+            attach_data(learner, worker_data["dataX"], worker_data["dataY"])
+
+def train_bag(task):
+    """
+    @summary: Train the learner of one bag in a worker process
+    @param task: (learner class, learner arguments, bag seed, bag size)
+    """
+    learner, kwargs, seed, n_prime = task
+    dataX = worker_data["dataX"]
+    dataY = worker_data["dataY"]
+    rows, counts = bag_view( bag_sample(seed, dataX.shape[0], n_prime) )
+    bag_learner = learner( **kwargs )
+    bag_learner.addEvidence(dataX, dataY, rows, counts)
+    detach_data(bag_learner)
+    return bag_learner
+
+def query_bag(i):
+    """
+    @summary: Query the learner of bag i in a worker process
+    """
+    return worker_data["learners"][i].query( worker_data["points"] )
+
+def bag_sample(seed, n, n_prime, p = None):
+    """
+    @summary: Draw the row indexes of a bag, with replacement
+    @param seed: seed of the bag, the same seed always gives the same bag
+    @param p: probability of each row (default: uniform)
+    """
+    return np.random.RandomState(seed).choice(n, size=n_prime, replace=True, p=p)
+
+def bag_view(index_sample):
+    """
+    @summary: Compact representation of a bag
+    @returns the sorted distinct rows of the bag and how many times each was drawn
+    """
+    return np.unique(index_sample, return_counts=True)
+
 class BagLearner():
     
-    def __init__(self, learner = knn.KNNLearner, kwargs = {"k":3}, bags = 20, boost = False):
+    def __init__(self, learner = knn.KNNLearner, kwargs = {"k":3}, bags = 20, boost = False,
+                 n_jobs = 1, seed = None):
         
         self.learner = learner
         self.kwargs = kwargs
         self.bags = bags
         self.boost = boost
+        self.n_jobs = n_jobs if n_jobs > 0 else multiprocessing.cpu_count()
+        self.seed = seed #Seed of the bags, None draws it from np.random
         self.bag_learnt = 0 #Indicates how many bags have learnt
+        self.data_x = self.data_y = None #Training set, shared by all bags
+        self.shared = None #Training set in shared memory, when using workers
+        self.path = None #File the learner was memory mapped from, if any
         
         #Create the learners
         self.learners = [ learner( **kwargs ) for i in range(0, bags) ]
@@ -24,36 +112,72 @@ class BagLearner():
         @param dataX: X values of data to add
         @param dataY: the Y training values
         """
+        #Training again replaces the bags, including those mapped from a saved file
+        self.path = None
+        self.bag_learnt = 0
+        self.learners = [ self.learner( **self.kwargs ) for i in range(0, self.bags) ]
+        
         #Get n_prime, number of samples within each bag
         n = dataX.shape[0]
-        indexes = range(0, n)
-        n_prime = 0.6 * n       
+        n_prime = int(0.6 * n)
+        
+        #Each bag has its own seed, so bags do not depend on the number of workers
+        random = np.random if self.seed is None else np.random.RandomState(self.seed)
+        seeds = random.randint(0, 2 ** 31 - 1, size=self.bags)
+        
+        #Bags are views on one training set: each learner only keeps the rows
+        #of its bag and their counts. With workers, the set is in shared memory
+        self.shared = None
+        if self.n_jobs > 1:
+            self.shared = {"dataX": share_array(dataX), "dataY": share_array(dataY)}
+            dataX = np.frombuffer(self.shared["dataX"][0]).reshape(dataX.shape)
+            dataY = np.frombuffer(self.shared["dataY"][0]).reshape(dataY.shape)
+        self.data_x = dataX
+        self.data_y = dataY
+        
+        #Without boosting the bags are independent and can be learnt in parallel
+        if not self.boost and self.n_jobs > 1:
+            tasks = [ (self.learner, self.kwargs, seed, n_prime) for seed in seeds ]
+            pool = multiprocessing.Pool(self.n_jobs, init_worker, (self.shared, {}))
+            try:
+                self.learners = pool.map(train_bag, tasks)
+            finally:
+                pool.close()
+                pool.join()
+            for learner in self.learners:
+                attach_data(learner, dataX, dataY)
+            self.bag_learnt = self.bags
+            return
         
         #Create the first bag
-        index_sample = np.random.choice(indexes, size=n_prime, replace=True)
-        sample_x = dataX[index_sample, :]
-        sample_y = dataY[index_sample]
-        self.learners[0].addEvidence(sample_x, sample_y)
+        rows, counts = bag_view( bag_sample(seeds[0], n, n_prime) )
+        self.learners[0].addEvidence(dataX, dataY, rows, counts)
         self.bag_learnt += 1
         
+        #For boosting, keep the sum of the predictions of the learnt bags on the
+        #training set, so each new bag only queries the previous learner
+        if self.boost and self.bags > 1:
+            ensemble_sum = self.learners[0].query( dataX )
+        
         #Create the other bags sequentially depending wether we use boosting or not
         for i in range(1, self.bags):
             if self.boost:
                 #For boosting, each samples is weighted according to the classification error
-                errors = np.abs( self.query( dataX ) - dataY )
-                weights = errors / np.sum( errors )
+                errors = np.abs( ensemble_sum / self.bag_learnt - dataY )
+                weights = errors / np.sum( errors ) if np.sum( errors ) > 0 else None
                 #Choose n_prime random samples according to the weighting scheme
-                index_sample = np.random.choice(indexes, size=n_prime, replace=True, p=weights)
+                index_sample = bag_sample(seeds[i], n, n_prime, p=weights)
             else:
                 #For normal bagging, weighting scheme is uniform
-                index_sample = np.random.choice(indexes, size=n_prime, replace=True)
+                index_sample = bag_sample(seeds[i], n, n_prime)
                 
-            sample_x = dataX[index_sample, :]
-            sample_y = dataY[index_sample]
             #Learn this sub dataset
-            self.learners[i].addEvidence(sample_x, sample_y)                
+            rows, counts = bag_view(index_sample)
+            self.learners[i].addEvidence(dataX, dataY, rows, counts)
             #Mark this bags as learnt
             self.bag_learnt += 1
+            if self.boost and i < self.bags - 1:
+                ensemble_sum += self.learners[i].query( dataX )
             
     def query(self, points):
         """
@@ -64,11 +188,83 @@ class BagLearner():
         
         estimates = np.zeros( shape=( points.shape[0], self.bag_learnt ) )
         
-        #For each point, get the estimate of each bag        
-        for i in range(0, self.bag_learnt):
-            estimates[:, i] = self.learners[i].query(points)
+        #Query the bags in parallel, each worker receives the learners and points once,
+        #the learners without the training data that is shared
+        if self.n_jobs > 1 and self.bag_learnt > 1:
+            shared = {"points": share_array(points)}
+            learners = self.learners[0:self.bag_learnt]
+            if self.path is not None:
+                #Workers load the learners from the saved file themselves
+                objects = {"path": self.path}
+                learners = []
+            else:
+                if self.shared is None:
+                    self.shared = {"dataX": share_array(self.data_x), "dataY": share_array(self.data_y)}
+                shared.update(self.shared)
+                objects = {"learners": learners}
+            for learner in learners:
+                detach_data(learner)
+            try:
+                pool = multiprocessing.Pool(self.n_jobs, init_worker, (shared, objects))
+            finally:
+                for learner in learners:
+                    attach_data(learner, self.data_x, self.data_y)
+            try:
+                for i, estimate in enumerate( pool.map(query_bag, range(0, self.bag_learnt)) ):
+                    estimates[:, i] = estimate
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            #For each point, get the estimate of each bag        
+            for i in range(0, self.bag_learnt):
+                estimates[:, i] = self.learners[i].query(points)
             
         return np.mean(estimates, axis=1)
+
+    def get_state(self, include_data = True):
+        """
+        @summary: Parameters and arrays of the learner, see learners.Persistence.
+        The training set is saved once, each bag only saves its own arrays.
+        """
+        params = {"learner": self.learner.__name__, "kwargs": self.kwargs,
+                  "bags": self.bags, "boost": self.boost, "n_jobs": self.n_jobs,
+                  "seed": None if self.seed is None else int(self.seed),
+                  "bag_learnt": self.bag_learnt}
+        arrays = {"data_x": self.data_x, "data_y": self.data_y}
+        for i in range(0, self.bag_learnt):
+            bag_params, bag_arrays = self.learners[i].get_state(include_data = False)
+            for name, array in bag_arrays.items():
+                arrays["bag{}.{}".format(i, name)] = array
+        return params, arrays
+
+    @classmethod
+    def from_state(cls, params, arrays, dataX = None, dataY = None):
+        """
+        @summary: Rebuild a learner from get_state, arrays are not copied
+        """
+        from learners.Persistence import LEARNERS
+        learner = LEARNERS[ params["learner"] ]
+        bag_learner = cls(learner, params["kwargs"], params["bags"], params["boost"],
+                          params["n_jobs"], params["seed"])
+        bag_learner.data_x = arrays["data_x"]
+        bag_learner.data_y = arrays["data_y"]
+        for i in range(0, params["bag_learnt"]):
+            prefix = "bag{}.".format(i)
+            bag_arrays = dict((name[len(prefix):], array) for name, array in arrays.items()
+                              if name.startswith(prefix))
+            bag_learner.learners[i] = learner.from_state(params["kwargs"], bag_arrays,
+                                                         bag_learner.data_x, bag_learner.data_y)
+        bag_learner.bag_learnt = params["bag_learnt"]
+        return bag_learner
+
+    def save(self, path):
+        """
+        @summary: Save the learner in a binary file, load it with
+        learners.Persistence.load_learner
+        """
+        from learners.Persistence import save_learner
+        save_learner(self, path)
             
     
 if __name__=="__main__":
@@ -0,0 +1,155 @@
+"""
+A simple KD-tree for K nearest neighbor searches.
+"""
+
+import heapq
+import numpy as np
+
+class KDTree(object):
+
+    def __init__(self, data, leaf_size = 16, rows = None):
+        """
+        @summary: Build the tree over the rows of data. The tree does not keep
+        the data, it must be given again to query the tree.
+        @param data: numpy array with one point per row
+        @param leaf_size: maximum number of points in a leaf
+        @param rows: rows of data to index (default: all rows)
+        """
+        self.leaf_size = leaf_size
+        self.rows = rows
+
+        #Rows with missing values are kept out of the tree, their distances
+        #are not ordered. They come last, as with np.argsort of the distances
+        finite = np.isfinite(data if rows is None else data[rows, :]).all(axis = 1)
+        self.missing = np.flatnonzero(~finite)
+
+        #Points are reordered so that each node owns a contiguous slice
+        self.index = np.flatnonzero(finite)
+        n = self.index.shape[0]
+        self.split_dim = []
+        self.split_value = []
+        self.children = []
+        self.bounds = []
+
+        #Build the nodes top down, splitting at the median of the widest dimension
+        pending = [ self._add_node(0, n) ]
+        while pending:
+            node = pending.pop()
+            start, end = self.bounds[node]
+            if end - start <= leaf_size:
+                continue
+
+            points = data[self._rows(start, end), :]
+            spread = points.max(axis = 0) - points.min(axis = 0)
+            dim = np.argmax(spread)
+            if spread[dim] == 0:
+                continue #All points are equal, keep them in a leaf
+
+            middle = (end - start) // 2
+            order = np.argpartition(points[:, dim], middle)
+            self.index[start:end] = self.index[start:end][order]
+
+            self.split_dim[node] = dim
+            self.split_value[node] = points[order[middle], dim]
+            left = self._add_node(start, start + middle)
+            right = self._add_node(start + middle, end)
+            self.children[node] = (left, right)
+            pending.extend([left, right])
+
+    def to_arrays(self):
+        """
+        @summary: Arrays describing the tree, to save it
+        """
+        children = [ (-1, -1) if c is None else c for c in self.children ]
+        return {"index": self.index,
+                "missing": self.missing,
+                "split_dim": np.array(self.split_dim, dtype = int),
+                "split_value": np.array(self.split_value, dtype = float),
+                "children": np.array(children, dtype = int).reshape(-1, 2),
+                "bounds": np.array(self.bounds, dtype = int).reshape(-1, 2)}
+
+    @classmethod
+    def from_arrays(cls, arrays, leaf_size, rows = None):
+        """
+        @summary: Rebuild a tree saved with to_arrays, the index is not copied
+        """
+        tree = cls.__new__(cls)
+        tree.leaf_size = leaf_size
+        tree.rows = rows
+        tree.index = arrays["index"]
+        tree.missing = arrays.get("missing", np.zeros(0, dtype = int))
+        tree.split_dim = arrays["split_dim"].tolist()
+        tree.split_value = arrays["split_value"].tolist()
+        tree.children = [ None if left < 0 else (left, right)
+                          for left, right in arrays["children"].tolist() ]
+        tree.bounds = [ tuple(b) for b in arrays["bounds"].tolist() ]
+        return tree
+
+    def _rows(self, start, end):
+        """Rows of data owned by the slice start:end of the index"""
+        if self.rows is None:
+            return self.index[start:end]
+        return self.rows[ self.index[start:end] ]
+
+    def _add_node(self, start, end):
+        self.split_dim.append(-1)
+        self.split_value.append(0.0)
+        self.children.append(None)
+        self.bounds.append((start, end))
+        return len(self.bounds) - 1
+
+    def query(self, data, point, k):
+        """
+        @summary: Find the k nearest neighbors of a point
+        @param data: the data the tree was built on
+        @param point: numpy array with the coordinates of the point
+        @param k: number of neighbors
+        @returns the squared distances and the positions of the neighbors among
+        the indexed rows, sorted by distance (ties by position)
+        """
+        if not np.isfinite(point).all():
+            #Every distance is missing, np.argsort keeps the training order
+            n = min(k, self.index.shape[0] + self.missing.shape[0])
+            return np.empty(n) * np.nan, np.arange(n)
+
+        #Max heap of the best candidates found so far, as (-distance, -position)
+        best = []
+        pending = [ (0, 0.0) ] #(node, lower bound of the squared distance)
+        while pending:
+            node, bound = pending.pop()
+            if len(best) == k and bound > -best[0][0]:
+                continue
+
+            if self.children[node] is None:
+                #Leaf: exhaustive search on its points
+                start, end = self.bounds[node]
+                positions = self.index[start:end]
+                distances = ((data[self._rows(start, end), :] - point) ** 2).sum(axis = 1)
+                for distance, position in zip(distances, positions):
+                    candidate = (-distance, -position)
+                    if len(best) < k:
+                        heapq.heappush(best, candidate)
+                    elif candidate > best[0]:
+                        heapq.heapreplace(best, candidate)
+                continue
+
+            #Visit first the side of the split containing the point
+            left, right = self.children[node]
+            diff = point[ self.split_dim[node] ] - self.split_value[node]
+            near, far = (left, right) if diff <= 0 else (right, left)
+            pending.append( (far, max(bound, diff * diff)) )
+            pending.append( (near, bound) )
+
+        best.sort(reverse = True)
+        distances = [ -d for d, i in best ]
+        indexes = [ -i for d, i in best ]
+
+        #Not enough points in the tree, complete with the rows with missing values
+        missing = self.missing[0:k - len(best)]
+        distances = np.array(distances + [np.nan] * len(missing))
+        indexes = np.array(indexes + missing.tolist(), dtype = int)
+        return distances, indexes
+
+
+if __name__=="__main__":
+    print "the secret clue is 'zzyzx'"
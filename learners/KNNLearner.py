@@ -3,22 +3,39 @@ A simple wrapper for K Nearest Neighbor.
 """
 
 import numpy as np
+from learners.KDTree import KDTree
         
 class KNNLearner(object):
 
-    def __init__(self, k = 3):
+    def __init__(self, k = 3, method = "auto", leaf_size = 16, max_tree_dims = 10,
+                 block_size = None, max_memory = 256 * 1024 ** 2):
         self.k = k #Number of neighbors
+        self.method = method #"kdtree", "batch", "brute" or "auto"
+        self.leaf_size = leaf_size
+        self.max_tree_dims = max_tree_dims #Above, KD-trees are not better than brute force
+        self.block_size = block_size #Query rows per distance block in batch mode
+        self.max_memory = max_memory #Bytes per block when block_size is not given
         pass # move along, these aren't the drones you're looking for
 
-    def addEvidence(self,dataX,dataY):
+    def addEvidence(self,dataX,dataY,rows=None,counts=None):
         """
         @summary: Add training data to learner
         @param dataX: X values of data to add
         @param dataY: the Y training values
+        @param rows: learn only these rows of the data, sorted (default: all rows)
+        @param counts: number of times each row is repeated (default: once)
         """        
-        #Save the evidence in a dictionary for later O(n) searching        
+        #Save the evidence and index it for the nearest neighbor searches.
+        #The data is not copied, so several learners can share it with their
+        #own rows and counts
         self.data_x = dataX
         self.data_y = dataY
+        self.rows = rows
+        self.counts = counts
+        self.tree = None
+        if self.method == "kdtree" or \
+           (self.method == "auto" and dataX.shape[1] <= self.max_tree_dims):
+            self.tree = KDTree(dataX, self.leaf_size, rows)
                         
     def query(self, points):
         """
@@ -26,21 +43,137 @@ class KNNLearner(object):
         @param points: should be a numpy array with each row corresponding to a specific query.
         @returns the estimated values according to the saved model.
         """
+        if self.method == "batch" or (self.method == "auto" and self.tree is None):
+            return self.query_batch(points)
+
         #Create output array
         estimates = np.zeros( points.shape[0] )
+        if self.tree is None:
+            train_x, train_y, counts = self.view()
         
-        #This is not the optimal way to do it. We could use KDTrees from scipy
-        #for an efficient spacial search. The instructions for this assigment 
-        #prevent us from using this library 
+        #Neighbors at the same distance are taken in training order, so the
+        #KD-tree and the brute force search return the same neighbors
         for i, p in enumerate( points ):
-            #Euclidean dist of p against all other points in the dataset
-            distances = np.linalg.norm( p - self.data_x, ord = 2, axis = 1) 
-            K_neighbors_index = np.argsort( distances )[0:self.k]
-            K_neighbors_y = self.data_y[ K_neighbors_index ]
-            estimates[i] = np.mean( K_neighbors_y )
+            if self.tree is not None:
+                distances, K_neighbors_index = self.tree.query(self.data_x, p, self.k)
+            else:
+                #Squared euclidean dist of p against all other points in the dataset
+                distances = ( (p - train_x) ** 2 ).sum(axis = 1)
+                K_neighbors_index = np.argsort( distances, kind = "mergesort" )[0:self.k]
+            estimates[i] = self.neighbors_mean( K_neighbors_index[np.newaxis, :] )[0]
             
         return estimates     
 
+    def query_batch(self, points):
+        """
+        @summary: Estimate a set of test points by brute force, computing the
+        distances of blocks of query rows against all training points at once.
+        Neighbors at the same distance are taken in no particular order.
+        @param points: should be a numpy array with each row corresponding to a specific query.
+        @returns the estimated values according to the saved model.
+        """
+        estimates = np.zeros( points.shape[0] )
+        train_x, train_y, counts = self.view()
+        n = train_x.shape[0]
+        k = min(self.k, n)
+
+        #Each block needs about three (rows x n) arrays: products, distances and partition
+        rows = self.block_size
+        if rows is None:
+            rows = max(1, int(self.max_memory // (3 * 8 * n)))
+
+        #Squared distances as |a|^2 + |b|^2 - 2ab, only the k smallest are selected
+        train_sq = (train_x ** 2).sum(axis = 1)
+        for start in range(0, points.shape[0], rows):
+            block = points[start:start + rows, :]
+            distances = np.dot(block, train_x.T)
+            distances *= -2
+            distances += train_sq
+            distances += (block ** 2).sum(axis = 1)[:, np.newaxis]
+            K_neighbors_index = np.argpartition(distances, k - 1, axis = 1)[:, 0:k]
+            if counts is not None:
+                #Repeated rows count several times, sort the neighbors by distance
+                lines = np.arange(block.shape[0])[:, np.newaxis]
+                order = np.argsort(distances[lines, K_neighbors_index], axis = 1)
+                K_neighbors_index = K_neighbors_index[lines, order]
+            estimates[start:start + rows] = self.neighbors_mean(K_neighbors_index)
+
+        return estimates
+
+    def get_state(self, include_data = True):
+        """
+        @summary: Parameters and arrays of the learner, see learners.Persistence
+        @param include_data: include the training data (not when it is shared)
+        """
+        params = {"k": self.k, "method": self.method, "leaf_size": self.leaf_size,
+                  "max_tree_dims": self.max_tree_dims, "block_size": self.block_size,
+                  "max_memory": self.max_memory}
+        arrays = {}
+        if include_data:
+            arrays["data_x"] = self.data_x
+            arrays["data_y"] = self.data_y
+        if self.rows is not None:
+            arrays["rows"] = self.rows
+        if self.counts is not None:
+            arrays["counts"] = self.counts
+        if self.tree is not None:
+            for name, array in self.tree.to_arrays().items():
+                arrays["tree." + name] = array
+        return params, arrays
+
+    @classmethod
+    def from_state(cls, params, arrays, dataX = None, dataY = None):
+        """
+        @summary: Rebuild a learner from get_state, arrays are not copied
+        @param dataX, dataY: the training data when it was not included
+        """
+        learner = cls(**params)
+        learner.data_x = arrays.get("data_x", dataX)
+        learner.data_y = arrays.get("data_y", dataY)
+        learner.rows = arrays.get("rows")
+        learner.counts = arrays.get("counts")
+        learner.tree = None
+        if "tree.index" in arrays:
+            tree_arrays = dict((name[5:], array) for name, array in arrays.items()
+                               if name.startswith("tree."))
+            learner.tree = KDTree.from_arrays(tree_arrays, learner.leaf_size, learner.rows)
+        return learner
+
+    def save(self, path):
+        """
+        @summary: Save the learner in a binary file, load it with
+        learners.Persistence.load_learner
+        """
+        from learners.Persistence import save_learner
+        save_learner(self, path)
+
+    def view(self):
+        """
+        @summary: Training data of this learner, gathered from the shared data
+        @returns X values, Y values and counts of the learnt rows
+        """
+        if self.rows is None:
+            return self.data_x, self.data_y, self.counts
+        return self.data_x[self.rows, :], self.data_y[self.rows], self.counts
+
+    def neighbors_mean(self, neighbors):
+        """
+        @summary: Mean Y value of the k nearest neighbors of each query
+        @param neighbors: positions of the neighbors among the learnt rows, one
+        query per row, sorted by distance when rows have counts
+        @returns the estimate of each query
+        """
+        rows = neighbors if self.rows is None else self.rows[neighbors]
+        neighbors_y = self.data_y[rows]
+        if self.counts is None:
+            return np.mean(neighbors_y, axis = 1)
+
+        #A row repeated c times counts as c neighbors, up to k neighbors in total
+        counts = self.counts[neighbors]
+        previous = np.cumsum(counts, axis = 1) - counts
+        weights = np.clip(self.k - previous, 0, counts)
+        return (weights * neighbors_y).sum(axis = 1) / weights.sum(axis = 1)
+
 
 if __name__=="__main__":
     print "the secret clue is 'zzyzx'"
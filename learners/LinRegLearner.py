@@ -6,22 +6,115 @@ import numpy as np
 
 class LinRegLearner(object):
 
-    def __init__(self):
+    def __init__(self, streaming = False, forgetting = 1.0):
+        self.streaming = streaming #Successive addEvidence calls add up instead of replacing the model
+        self.forgetting = forgetting #Weight of a row is multiplied by it for each newer row
+        self.xtx = None #Sufficient statistics X'X and X'Y of the evidence seen so far
+        self.xty = None
         pass # move along, these aren't the drones you're looking for
 
-    def addEvidence(self,dataX,dataY):
+    def addEvidence(self,dataX,dataY,rows=None,counts=None):
         """
         @summary: Add training data to learner
         @param dataX: X values of data to add
         @param dataY: the Y training values
+        @param rows: learn only these rows of the data (default: all rows)
+        @param counts: number of times each row is repeated (default: once)
         """
+        if rows is not None:
+            dataX = dataX[rows, :]
+            dataY = dataY[rows]
+
         # slap on 1s column so linear regression finds a constant term
         newdataX = np.ones([dataX.shape[0],dataX.shape[1]+1])
         newdataX[:,0:dataX.shape[1]]=dataX
 
+        # a row repeated c times weighs sqrt(c) in the least squares problem
+        if counts is not None:
+            weights = np.sqrt(counts)
+            newdataX = newdataX * weights[:, np.newaxis]
+            dataY = dataY * weights
+
+        if self.streaming:
+            self.accumulate(newdataX, dataY)
+            self.solve()
+            return
+
         # build and save the model
         self.model_coefs, residuals, rank, s = np.linalg.lstsq(newdataX, dataY)
+
+    def addEvidenceChunks(self, chunks):
+        """
+        @summary: Add training data given in chunks, e.g. from a generator reading
+        a file too large for memory. Only X'X and X'Y are kept between chunks.
+        @param chunks: iterable of (dataX, dataY) pairs
+        """
+        if not self.streaming:
+            self.xtx = self.xty = None
+        for dataX, dataY in chunks:
+            newdataX = np.ones([dataX.shape[0],dataX.shape[1]+1])
+            newdataX[:,0:dataX.shape[1]]=dataX
+            self.accumulate(newdataX, dataY)
+        self.solve()
+
+    def accumulate(self, newdataX, dataY):
+        """
+        @summary: Add rows (with the 1s column) to the sufficient statistics,
+        older rows are discounted by the forgetting factor
+        """
+        if self.xtx is None:
+            self.xtx = np.zeros([newdataX.shape[1], newdataX.shape[1]])
+            self.xty = np.zeros(newdataX.shape[1])
+
+        n = newdataX.shape[0]
+        if self.forgetting != 1.0:
+            # the newest row weighs 1, the previous one forgetting, and so on
+            weights = self.forgetting ** np.arange(n - 1, -1, -1, dtype = float)
+            self.xtx *= self.forgetting ** n
+            self.xty *= self.forgetting ** n
+            self.xtx += np.dot(newdataX.T * weights, newdataX)
+            self.xty += np.dot(newdataX.T * weights, dataY)
+        else:
+            self.xtx += np.dot(newdataX.T, newdataX)
+            self.xty += np.dot(newdataX.T, dataY)
+
+    def solve(self):
+        """
+        @summary: Build the model from the normal equations X'X b = X'Y
+        """
+        self.model_coefs, residuals, rank, s = np.linalg.lstsq(self.xtx, self.xty)
         
+    def get_state(self, include_data = True):
+        """
+        @summary: Parameters and arrays of the learner, see learners.Persistence
+        """
+        params = {"streaming": self.streaming, "forgetting": self.forgetting}
+        arrays = {"model_coefs": self.model_coefs}
+        if self.xtx is not None:
+            arrays["xtx"] = self.xtx
+            arrays["xty"] = self.xty
+        return params, arrays
+
+    @classmethod
+    def from_state(cls, params, arrays, dataX = None, dataY = None):
+        """
+        @summary: Rebuild a learner from get_state
+        """
+        learner = cls(**params)
+        learner.model_coefs = arrays["model_coefs"]
+        if "xtx" in arrays:
+            learner.xtx = np.array(arrays["xtx"])
+            learner.xty = np.array(arrays["xty"])
+        return learner
+
+    def save(self, path):
+        """
+        @summary: Save the learner in a binary file, load it with
+        learners.Persistence.load_learner
+        """
+        from learners.Persistence import save_learner
+        save_learner(self, path)
+
     def query(self,points):
         """
         @summary: Estimate a set of test points given the model we built.
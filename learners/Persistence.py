@@ -0,0 +1,92 @@
+"""
+Save and load learners in a compact binary file.
+
+The file holds a small JSON header (learner class, parameters and the
+layout of the arrays) followed by the raw arrays, each aligned to 64
+bytes. On load the arrays are memory mapped, so a trained ensemble opens
+in milliseconds and its pages are shared read-only between the processes
+that load the same file.
+"""
+
+import json
+import struct
+import numpy as np
+
+import learners.KNNLearner as knn
+import learners.LinRegLearner as lrl
+import learners.BagLearner as bag
+
+MAGIC = b"MLTLEARN"
+ALIGN = 64
+
+#Learner classes that can be saved, by name
+LEARNERS = {"KNNLearner": knn.KNNLearner,
+            "LinRegLearner": lrl.LinRegLearner,
+            "BagLearner": bag.BagLearner}
+
+def aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+def save_learner(learner, path):
+    """
+    @summary: Save a trained learner in a binary file
+    @param learner: KNNLearner, LinRegLearner or BagLearner
+    @param path: file name
+    """
+    params, arrays = learner.get_state()
+
+    #Layout of the arrays, offsets are relative to the end of the header
+    layout = {}
+    offset = 0
+    for name in sorted(arrays):
+        array = np.ascontiguousarray(arrays[name])
+        arrays[name] = array
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = aligned(offset + array.nbytes)
+
+    header = json.dumps({"learner": learner.__class__.__name__, "params": params, "arrays": layout})
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header.encode("utf-8"))
+        start = aligned(f.tell())
+        for name in sorted(arrays):
+            f.seek(start + layout[name]["offset"])
+            f.write(arrays[name].tobytes())
+
+def load_learner(path, mmap = True):
+    """
+    @summary: Load a learner saved with save_learner
+    @param path: file name
+    @param mmap: memory map the arrays (read-only) instead of reading them
+    @returns the learner, ready to be queried
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a saved learner".format(path))
+        length = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(length).decode("utf-8"))
+        start = aligned(f.tell())
+
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(str(spec["dtype"]))
+            shape = tuple(spec["shape"])
+            count = int(np.prod(shape))
+            if count == 0:
+                arrays[name] = np.zeros(shape, dtype = dtype)
+            elif mmap:
+                arrays[name] = np.memmap(path, dtype = dtype, mode = "r",
+                                         offset = start + spec["offset"], shape = shape)
+            else:
+                f.seek(start + spec["offset"])
+                arrays[name] = np.fromfile(f, dtype = dtype, count = count).reshape(shape)
+
+    learner = LEARNERS[header["learner"]].from_state(header["params"], arrays)
+    if mmap and hasattr(learner, "path"):
+        learner.path = path
+    return learner
+
+
+if __name__=="__main__":
+    print "the secret clue is 'zzyzx'"
@@ -0,0 +1,82 @@
+"""
+Walk-forward rolling-window linear regression.
+"""
+
+import numpy as np
+import pandas as pd
+
+def walk_forward(dataX, dataY, window, refresh = None):
+    """
+    @summary: Refit a linear regression every day on the last window rows and
+    predict the next row, in a single pass. The normal equations X'X b = X'Y of
+    the window are updated with the new row and downdated with the row leaving
+    the window instead of being rebuilt.
+    @param dataX: X values, a numpy array or a DataFrame indexed by date
+    @param dataY: the Y values, a numpy array or a Series
+    @param window: number of rows of each fit
+    @param refresh: rebuild the normal equations from scratch every refresh rows
+    to limit the rounding errors of the updates (default: window)
+    @returns with numpy arrays: the coefficients of the fit ending at each row,
+    constant term last as in LinRegLearner, and the one-step-ahead prediction of
+    each row made by the fit ending the row before (NaN when not available).
+    With a DataFrame: one DataFrame with a Coef_ column per feature, Intercept
+    and Prediction columns.
+    """
+    index = getattr(dataX, "index", None)
+    columns = getattr(dataX, "columns", None)
+    if columns is None and getattr(dataX, "name", None) is not None:
+        columns = [dataX.name]
+    dataX = np.asarray(dataX, dtype = float)
+    dataY = np.asarray(dataY, dtype = float)
+    if dataX.ndim == 1:
+        dataX = dataX[:, np.newaxis]
+    if refresh is None:
+        refresh = window
+
+    # slap on 1s column so linear regression finds a constant term
+    n = dataX.shape[0]
+    newdataX = np.ones([n, dataX.shape[1] + 1])
+    newdataX[:, 0:dataX.shape[1]] = dataX
+
+    coefs = np.empty(newdataX.shape) * np.nan
+    predictions = np.empty(n) * np.nan
+    xtx = np.zeros([newdataX.shape[1], newdataX.shape[1]])
+    xty = np.zeros(newdataX.shape[1])
+    for t in range(0, n):
+        start = t - window + 1
+        if start > 0 and start % refresh == 0:
+            #Rebuild from the rows of the window
+            rows = newdataX[start:t + 1, :]
+            xtx = np.dot(rows.T, rows)
+            xty = np.dot(rows.T, dataY[start:t + 1])
+        else:
+            #Rank one update with the new row, downdate with the one leaving
+            row = newdataX[t, :]
+            xtx += np.outer(row, row)
+            xty += row * dataY[t]
+            if start > 0:
+                old = newdataX[start - 1, :]
+                xtx -= np.outer(old, old)
+                xty -= old * dataY[start - 1]
+
+        if start < 0:
+            continue
+        try:
+            coefs[t, :] = np.linalg.solve(xtx, xty)
+        except np.linalg.LinAlgError:
+            coefs[t, :] = np.linalg.lstsq(xtx, xty)[0]
+        if t + 1 < n:
+            predictions[t + 1] = np.dot(newdataX[t + 1, :], coefs[t, :])
+
+    if index is None:
+        return coefs, predictions
+
+    names = [ "Coef_{}".format(c) for c in columns ] if columns is not None \
+        else [ "Coef_{}".format(i) for i in range(0, dataX.shape[1]) ]
+    results = pd.DataFrame(coefs, index = index, columns = names + ["Intercept"])
+    results["Prediction"] = predictions
+    return results
+
+
+if __name__=="__main__":
+    print "the secret clue is 'zzyzx'"
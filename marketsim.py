@@ -1,36 +1,76 @@
 """MC2-P1: Market simulator."""
 
 import pandas as pd
+import numpy as np
 import os
 
 from util import get_data, plot_data
 from portfolio.analysis import get_portfolio_value, get_portfolio_stats, plot_normalized_data
 
-def compute_portvals(start_date, end_date, orders_file, start_val):
-    """Compute daily portfolio value given a sequence of orders in a CSV file.
+def compute_portvals(start_date, end_date, orders_file, start_val, vectorized=True, prices=None):
+    """Compute daily portfolio value given a sequence of orders.
 
     Parameters
     ----------
         start_date: first date to track
         end_date: last date to track
-        orders_file: CSV file to read orders from
+        orders_file: CSV file to read orders from, or the orders themselves
+        as a DataFrame (or array) with Date, Symbol, Order and Shares columns
         start_val: total starting cash available
+        vectorized: simulate with array operations (default) instead of the
+        day by day loop
+        prices: daily prices already loaded, as returned by get_data, with a
+        column per traded symbol. Only symbols it lacks are read.
 
     Returns
     -------
         portvals: portfolio value for each trading day from start_date to end_date (inclusive)
     """
     
-    #Read order file
-    orders = pd.read_csv( orders_file, parse_dates = [0])
+    #Read order file, or take the orders given
+    if isinstance(orders_file, basestring):
+        orders = pd.read_csv( orders_file, parse_dates = [0])
+    else:
+        orders = pd.DataFrame(orders_file, columns = ["Date", "Symbol", "Order", "Shares"])
+        orders["Date"] = pd.to_datetime(orders["Date"])
+        orders["Shares"] = pd.to_numeric(orders["Shares"])
     
     #Get symbols making up the portfolio
     stock_symbols = list( set( orders["Symbol"] ) )
     dates =  pd.date_range(start_date, end_date)
     
-    #Read stock prices
-    stock_prices = get_data(stock_symbols, dates)
+    #Read stock prices, unless given
+    if prices is None:
+        stock_prices = get_data(stock_symbols, dates)
+    else:
+        stock_prices = prices[ (prices.index >= dates[0]) & (prices.index <= dates[-1]) ]
+        missing = [symbol for symbol in stock_symbols if symbol not in stock_prices.columns]
+        if missing:
+            stock_prices = stock_prices.join(get_data(missing, dates, addSPY=False))
     
+    if vectorized:
+        return simulate_orders(orders, stock_prices[stock_symbols], start_val)
+    
+    return simulate_orders_loop(orders, stock_symbols, stock_prices, start_val)
+
+
+def simulate_orders_loop(orders, stock_symbols, stock_prices, start_val):
+    """Simulate a sequence of orders day by day.
+
+    Reference implementation of the market simulator, see simulate_orders
+    for the vectorized version.
+
+    Parameters
+    ----------
+        orders: DataFrame with Date, Symbol, Order and Shares columns
+        stock_symbols: symbols traded in the orders
+        stock_prices: daily prices for each traded symbol
+        start_val: total starting cash available
+
+    Returns
+    -------
+        portfolio: daily positions, _CASH, _VALUE and _LEVERAGE
+    """
     #Create a portfolio keeping track of positions, 
     #_CASH column indicates cash position,  _VALUE total portfolio value
     #_LEVERAGE the leverage of portfolio when we allow for short selling
@@ -100,6 +140,82 @@ def compute_portvals(start_date, end_date, orders_file, start_val):
     return portfolio
 
 
+def simulate_orders(orders, stock_prices, start_val):
+    """Simulate a sequence of orders with array operations.
+
+    Orders are turned into a dense (dates x symbols) matrix of signed share
+    changes, holdings are its cumulative sum and cash, value and leverage
+    are computed for all days at once. Orders on dates without prices are
+    ignored, as in the day by day simulation.
+
+    Parameters
+    ----------
+        orders: DataFrame with Date, Symbol, Order and Shares columns
+        stock_prices: daily prices, one column per traded symbol
+        start_val: total starting cash available
+
+    Returns
+    -------
+        portfolio: daily positions, _CASH, _VALUE and _LEVERAGE
+    """
+    stock_symbols = list(stock_prices.columns)
+    prices = stock_prices.values.astype(np.float64)
+    n_dates, n_symbols = prices.shape
+    
+    #Side of each order: +1 buys, -1 sells
+    order = orders["Order"].values.astype(str)
+    side = np.where(order == "BUY", 1, 0) - np.where(order == "SELL", 1, 0)
+    if np.any(side == 0):
+        raise ValueError("Order not recognized.")
+    
+    #Locate each order in the price matrix, dropping non trading days
+    date_pos = stock_prices.index.get_indexer(orders["Date"])
+    symbol_pos = pd.Index(stock_symbols).get_indexer(orders["Symbol"])
+    if np.any(symbol_pos < 0):
+        unknown = sorted(set(orders["Symbol"].values[symbol_pos < 0]))
+        raise ValueError("No prices for symbols: {}".format(", ".join(map(str, unknown))))
+    valid = date_pos >= 0
+    date_pos = date_pos[valid]
+    symbol_pos = symbol_pos[valid]
+    shares = side[valid] * pd.to_numeric(orders["Shares"]).values[valid]
+    
+    #Signed share changes per day and symbol, holdings are the running sum
+    deltas = np.zeros((n_dates, n_symbols), dtype=shares.dtype)
+    np.add.at(deltas, (date_pos, symbol_pos), shares)
+    holdings = np.cumsum(deltas, axis=0)
+    
+    #Cash follows the orders day by day (file order within a day),
+    #keep the balance after the last order of each day
+    sequence = np.argsort(date_pos, kind="mergesort")
+    order_cash = -shares[sequence] * prices[date_pos[sequence], symbol_pos[sequence]]
+    running_cash = np.cumsum(np.concatenate(([float(start_val)], order_cash)))
+    last_order = np.searchsorted(date_pos[sequence], np.arange(n_dates), side="right")
+    cash = running_cash[last_order]
+    
+    #Value and leverage, accumulated symbol by symbol as in the daily loop
+    notional = prices * holdings
+    value = cash.copy()
+    longs = np.zeros(n_dates)
+    shorts = np.zeros(n_dates)
+    for j in range(n_symbols):
+        is_long = holdings[:, j] > 0
+        longs += np.where(is_long, notional[:, j], 0.0)
+        shorts += np.where(is_long, 0.0, notional[:, j])
+        value += notional[:, j]
+    leverage = (longs + shorts) / (longs - shorts + cash)
+    
+    #Assert we never achieve a leverage > 2.0
+    if np.any(leverage > 2):
+        raise ValueError("Leverage > 2.0 achieved")
+    
+    portfolio = pd.DataFrame(holdings, index=stock_prices.index, columns=stock_symbols)
+    portfolio["_CASH"] = cash
+    portfolio["_VALUE"] = value
+    portfolio["_LEVERAGE"] = leverage
+    
+    return portfolio
+
+
 def test_run():
     """Driver function."""
     # Define input parameters
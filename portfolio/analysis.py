@@ -60,6 +60,68 @@ def get_portfolio_stats(port_val, daily_rf=0, samples_per_year=252):
     return cum_ret, avg_daily_ret, std_daily_ret, sharpe_ratio
 
 
+def get_portfolio_values(prices, allocs, start_val=1):
+    """Compute the daily values of many portfolios at once.
+
+    Parameters
+    ----------
+        prices: daily prices for each stock, DataFrame or (dates x stocks) array
+        allocs: (portfolios x stocks) array, one allocation per row
+        start_val: total starting value invested in each portfolio (default: 1)
+
+    Returns
+    -------
+        port_vals: (portfolios x dates) array of daily portfolio values, each
+        row as get_portfolio_value gives for its allocation
+    """
+    prices = np.asarray(prices, dtype=float)
+    normed = np.nan_to_num(prices / prices[0]) #Missing prices count as 0, as in the sum of get_portfolio_value
+    return start_val * np.dot(np.atleast_2d(allocs), normed.T)
+
+
+def get_portfolio_stats_batch(prices, allocs, daily_rf=0, samples_per_year=252,
+                              max_memory=256 * 1024 ** 2):
+    """Calculate the statistics of many portfolios at once.
+
+    Portfolios are evaluated by chunks, one matrix product per chunk, so that
+    the daily values and returns of a chunk fit in max_memory bytes.
+
+    Parameters
+    ----------
+        prices: daily prices for each stock, DataFrame or (dates x stocks) array
+        allocs: (portfolios x stocks) array, one allocation per row
+        daily_rf: daily risk-free rate of return (default: 0%)
+        samples_per_year: frequency of sampling (default: 252 trading days)
+        max_memory: memory budget of a chunk, in bytes
+
+    Returns
+    -------
+        cum_ret, avg_daily_ret, std_daily_ret, sharpe_ratio: arrays with the
+        statistics of each portfolio, as computed by get_portfolio_stats
+    """
+    prices = np.asarray(prices, dtype=float)
+    allocs = np.atleast_2d(np.asarray(allocs, dtype=float))
+    normed = np.nan_to_num(prices / prices[0]) #Missing prices count as 0, as in the sum of get_portfolio_value
+    n_portfolios = allocs.shape[0]
+    
+    #Values, returns and a temporary per portfolio and date
+    chunk_size = max(1, int(max_memory // (3 * 8 * max(prices.shape[0], 1))))
+    
+    cum_ret = np.empty(n_portfolios)
+    avg_daily_ret = np.empty(n_portfolios)
+    std_daily_ret = np.empty(n_portfolios)
+    for start in range(0, n_portfolios, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        port_vals = np.dot(allocs[chunk], normed.T)
+        daily_ret = port_vals[:, 1:] / port_vals[:, :-1] - 1
+        cum_ret[chunk] = port_vals[:, -1] / port_vals[:, 0] - 1.0
+        avg_daily_ret[chunk] = np.mean(daily_ret, axis=1)
+        std_daily_ret[chunk] = np.std(daily_ret, axis=1, ddof=1)
+    sharpe_ratio = samples_per_year / np.sqrt(samples_per_year) * (avg_daily_ret - daily_rf) / std_daily_ret
+    
+    return cum_ret, avg_daily_ret, std_daily_ret, sharpe_ratio
+
+
 def plot_normalized_data(df, title="Normalized prices", xlabel="Date", ylabel="Normalized price"):
     """Normalize given stock prices and plot for comparison.
 
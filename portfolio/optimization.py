@@ -28,30 +28,304 @@ def sharpe_maximizer(allocs, prices):
     return -sharpe_ratio
     
     
-def find_optimal_allocations(prices):
+def sharpe_gradient(allocs, normed, daily_rf=0, samples_per_year=252):
+    """Sharpe ratio of a portfolio and its gradient, to be passed to the optimizer.
+    
+    The portfolio is bought at the start and held, as in get_portfolio_value:
+    its daily value is V = normed . allocs and its daily returns are
+    r_t = V_t / V_t-1 - 1, so the derivative of r_t with respect to allocs is
+    (normed_t - (1 + r_t) normed_t-1) / V_t-1. The gradients of the mean and
+    standard deviation (ddof 1) of the returns follow, then the Sharpe ratio's.
+    
+    Parameters
+    ----------
+        allocs: Allocation for each portfolio component
+        normed: (dates x stocks) array of prices normalized by their first day
+        daily_rf: daily risk-free rate of return (default: 0%)
+        samples_per_year: frequency of sampling (default: 252 trading days)
+    
+    Returns
+    -------
+        sharpe_ratio, gradient: Negative sharpe ratio and its gradient, so the
+        minimizer finds the maximum
+    
+    """
+    port_val = np.dot(normed, allocs)
+    daily_ret = port_val[1:] / port_val[:-1] - 1
+    n = daily_ret.shape[0]
+    
+    avg_daily_ret = daily_ret.mean()
+    deviation = daily_ret - avg_daily_ret
+    std_daily_ret = np.sqrt(np.dot(deviation, deviation) / (n - 1))
+    
+    #Derivatives of the daily returns, one row per day
+    d_ret = (normed[1:] - (1 + daily_ret)[:, np.newaxis] * normed[:-1]) / port_val[:-1, np.newaxis]
+    d_avg = d_ret.mean(axis=0)
+    d_std = np.dot(deviation, d_ret) / ((n - 1) * std_daily_ret)
+    
+    factor = samples_per_year / np.sqrt(samples_per_year)
+    sharpe_ratio = factor * (avg_daily_ret - daily_rf) / std_daily_ret
+    gradient = factor * (d_avg / std_daily_ret - (avg_daily_ret - daily_rf) * d_std / std_daily_ret ** 2)
+    
+    return -sharpe_ratio, -gradient
+    
+    
+def find_optimal_allocations(prices, gradient=True, init_guess=None, verbose=True):
     """Find optimal allocations for a stock portfolio, optimizing for Sharpe ratio.
 
     Parameters
     ----------
         prices: daily prices for each stock in portfolio
+        gradient: use the analytic gradient of the Sharpe ratio (default)
+        instead of finite differences of sharpe_maximizer. The Sharpe ratio of
+        a buy and hold portfolio does not change when all allocations are
+        scaled, so the sum constraint is dropped and allocations are
+        normalized at the end, which lets L-BFGS-B handle hundreds of stocks.
+        init_guess: allocations the optimizer starts from, e.g. the previous
+        solution when re-optimizing (default: equally weighted portfolio)
+        verbose: print the optimization results
 
     Returns
     -------
         allocs: optimal allocations, as fractions that sum to 1.0
     """
 
-    #Initial guess, equally weighted portfolio
-    init_guess = np.ones(prices.shape[1], dtype=np.float64) * 1.0 / prices.shape[1]
-    alloc_bounds = [(0, prices.shape[1])] * 4
+    #Initial guess, equally weighted portfolio by default
+    n_symbols = prices.shape[1]
+    if init_guess is None:
+        init_guess = np.ones(n_symbols, dtype=np.float64) * 1.0 / n_symbols
+    alloc_bounds = [(0, 1)] * n_symbols
     alloc_constraint = ({ 'type': 'eq', 'fun': lambda x: np.sum(x) - 1 })
-    min_result = spo.minimize(sharpe_maximizer, init_guess, args = (prices, ), 
-                              method='SLSQP', options={'disp:': True}, 
-                                bounds = alloc_bounds, constraints = alloc_constraint)
+    if gradient:
+        #Normalized prices are computed once, missing prices count as 0 as in get_portfolio_value
+        values = np.asarray(prices, dtype=np.float64)
+        normed = np.nan_to_num(values / values[0])
+        min_result = spo.minimize(sharpe_gradient, init_guess, args = (normed, ), jac = True,
+                                  method='L-BFGS-B', bounds = alloc_bounds)
+        min_result.x = min_result.x / np.sum(min_result.x)
+    else:
+        min_result = spo.minimize(sharpe_maximizer, init_guess, args = (prices, ), 
+                                  method='SLSQP', options={'disp:': True}, 
+                                    bounds = alloc_bounds, constraints = alloc_constraint)
                                 
-    print min_result #Print optimization results
+    if verbose:
+        print min_result #Print optimization results
     return min_result.x
 
 
+def returns_moments(prices):
+    """Mean and covariance of the daily returns of each stock.
+
+    Parameters
+    ----------
+        prices: daily prices for each stock in portfolio
+
+    Returns
+    -------
+        mean: Series with the average daily return of each stock
+        cov: DataFrame with the covariance matrix of the daily returns
+    """
+    daily_ret = (prices / prices.shift(1) - 1)[1:]
+    return daily_ret.mean(), daily_ret.cov()
+
+
+def efficient_frontier(mean, cov, n_points=20, samples_per_year=252):
+    """Mean-variance efficient frontier of long only portfolios.
+
+    Each point minimizes the variance of the daily returns w' cov w for a
+    target average return mean' w, with allocations in [0, 1] summing to 1.
+    Targets go from the minimum variance portfolio to the best stock, and
+    each problem starts from the solution of the previous target.
+
+    Parameters
+    ----------
+        mean: average daily return of each stock, as returned by returns_moments
+        cov: covariance matrix of the daily returns
+        n_points: number of points of the frontier
+        samples_per_year: frequency of sampling (default: 252 trading days)
+
+    Returns
+    -------
+        frontier: DataFrame with one row per point, the allocation of each
+        stock, the AvgDailyReturn, StdDailyReturn and SharpeRatio
+    """
+    symbols = list(mean.index) if isinstance(mean, pd.Series) else range(len(mean))
+    mean = np.asarray(mean, dtype=np.float64)
+    cov = np.asarray(cov, dtype=np.float64)
+    n_symbols = mean.shape[0]
+
+    variance = lambda x: np.dot(x, np.dot(cov, x))
+    variance_jac = lambda x: 2 * np.dot(cov, x)
+    alloc_bounds = [(0, 1)] * n_symbols
+    sum_constraint = { 'type': 'eq', 'fun': lambda x: np.sum(x) - 1,
+                       'jac': lambda x: np.ones(n_symbols) }
+
+    #Minimum variance portfolio, the lowest return worth targeting
+    init_guess = np.ones(n_symbols, dtype=np.float64) * 1.0 / n_symbols
+    allocs = spo.minimize(variance, init_guess, jac = variance_jac, method='SLSQP',
+                          bounds = alloc_bounds, constraints = (sum_constraint, )).x
+    targets = np.linspace(np.dot(mean, allocs), mean.max(), n_points)
+
+    points = np.empty((n_points, n_symbols))
+    for i, target in enumerate(targets):
+        return_constraint = { 'type': 'eq', 'fun': lambda x, target=target: np.dot(mean, x) - target,
+                              'jac': lambda x: mean }
+        #Warm start from the neighboring point of the frontier
+        allocs = spo.minimize(variance, allocs, jac = variance_jac, method='SLSQP',
+                              bounds = alloc_bounds,
+                              constraints = (sum_constraint, return_constraint)).x
+        points[i] = allocs
+
+    frontier = pd.DataFrame(points, columns = symbols)
+    frontier["AvgDailyReturn"] = np.dot(points, mean)
+    frontier["StdDailyReturn"] = np.sqrt(np.maximum((np.dot(points, cov) * points).sum(axis=1), 0))
+    frontier["SharpeRatio"] = samples_per_year / np.sqrt(samples_per_year) \
+                              * frontier["AvgDailyReturn"] / frontier["StdDailyReturn"]
+    return frontier
+
+
+def moments_sharpe_gradient(allocs, mean, cov, samples_per_year=252):
+    """Sharpe ratio of daily returns with the given mean and covariance, and its gradient.
+
+    Returns
+    -------
+        sharpe_ratio, gradient: Negative sharpe ratio and its gradient, so the
+        minimizer finds the maximum
+    """
+    cov_allocs = np.dot(cov, allocs)
+    avg_daily_ret = np.dot(mean, allocs)
+    std_daily_ret = np.sqrt(np.dot(allocs, cov_allocs))
+    factor = samples_per_year / np.sqrt(samples_per_year)
+    sharpe_ratio = factor * avg_daily_ret / std_daily_ret
+    gradient = factor * (mean / std_daily_ret - avg_daily_ret * cov_allocs / std_daily_ret ** 3)
+    return -sharpe_ratio, -gradient
+
+
+def find_optimal_allocations_moments(mean, cov, init_guess=None):
+    """Find the allocations maximizing the Sharpe ratio from the mean and covariance
+    of the daily returns, as returned by returns_moments.
+
+    The Sharpe ratio does not change when all allocations are scaled, so as
+    in find_optimal_allocations only the bounds are enforced and the
+    allocations are normalized at the end.
+
+    Returns
+    -------
+        allocs: optimal allocations, as fractions that sum to 1.0
+    """
+    mean = np.asarray(mean, dtype=np.float64)
+    cov = np.asarray(cov, dtype=np.float64)
+    n_symbols = mean.shape[0]
+    if init_guess is None:
+        init_guess = np.ones(n_symbols, dtype=np.float64) * 1.0 / n_symbols
+    min_result = spo.minimize(moments_sharpe_gradient, init_guess, args = (mean, cov), jac = True,
+                              method='L-BFGS-B', bounds = [(0, 1)] * n_symbols)
+    return min_result.x / np.sum(min_result.x)
+
+
+def rolling_rebalance(prices, window=252, period=21, start_val=1000000, use_moments=True):
+    """Walk forward rebalancing: re-optimize the allocations every period days
+    over the trailing window, and trade to them.
+
+    The mean and covariance of the trailing daily returns are kept as running
+    sums, updated with the days entering the window and the days leaving it.
+    Each optimization starts from the previous allocations.
+
+    Parameters
+    ----------
+        prices: daily prices for each stock, without missing values
+        window: number of trailing days of each optimization
+        period: number of days between rebalancings
+        start_val: starting cash, fully invested at the first rebalancing
+        use_moments: maximize the Sharpe ratio of the trailing mean and
+        covariance (default), or the buy and hold Sharpe ratio of the trailing
+        prices with find_optimal_allocations
+
+    Returns
+    -------
+        orders: DataFrame with Date, Symbol, Order and Shares columns, for
+        marketsim.compute_portvals
+        allocations: DataFrame with the allocations chosen at each rebalancing
+    """
+    symbols = list(prices.columns)
+    values = prices.values.astype(np.float64)
+    daily_ret = np.zeros(values.shape)
+    daily_ret[1:] = values[1:] / values[:-1] - 1
+
+    #Running sums of the returns and of their outer products over the window
+    sum_ret = np.zeros(len(symbols))
+    sum_outer = np.zeros((len(symbols), len(symbols)))
+    first = last = 1 #Returns daily_ret[first:last] are in the sums
+
+    holdings = np.zeros(len(symbols))
+    cash = float(start_val)
+    allocs = None
+    orders = []
+    allocations = []
+    for t in range(window, values.shape[0], period):
+        #Slide the window to the returns of days t-window+1 to t
+        entering = daily_ret[last:t + 1]
+        leaving = daily_ret[first:t - window + 1]
+        sum_ret += entering.sum(axis=0) - leaving.sum(axis=0)
+        sum_outer += np.dot(entering.T, entering) - np.dot(leaving.T, leaving)
+        first, last = t - window + 1, t + 1
+
+        if use_moments:
+            mean = sum_ret / window
+            cov = (sum_outer - window * np.outer(mean, mean)) / (window - 1)
+            allocs = find_optimal_allocations_moments(mean, cov, init_guess=allocs)
+        else:
+            allocs = find_optimal_allocations(prices.iloc[first - 1:last], init_guess=allocs,
+                                              verbose=False)
+        allocations.append(allocs)
+
+        #Trade to the new allocations at the prices of the day, whole shares only
+        port_val = cash + np.dot(holdings, values[t])
+        target = np.trunc(allocs * port_val / values[t])
+        trades = target - holdings
+        cash -= np.dot(trades, values[t])
+        holdings = target
+        #Sells first, so they fund the buys of the day
+        for j in sorted(np.nonzero(trades)[0], key=lambda j: trades[j]):
+            orders.append({"Date": prices.index[t], "Symbol": symbols[j],
+                           "Order": "BUY" if trades[j] > 0 else "SELL", "Shares": abs(int(trades[j]))})
+
+    orders = pd.DataFrame(orders, columns = ["Date", "Symbol", "Order", "Shares"])
+    rebalance_dates = prices.index[window::period]
+    allocations = pd.DataFrame(allocations, index = rebalance_dates, columns = symbols)
+    return orders, allocations
+
+
+def rebalance_portfolio(start_date, end_date, symbols, window=252, period=21, start_val=1000000):
+    """Simulate a portfolio rebalanced every period days to optimal allocations."""
+    import marketsim
+
+    # Read in adjusted closing prices for given symbols, date range
+    dates = pd.date_range(start_date, end_date)
+    prices_all = get_data(symbols, dates)  # automatically adds SPY
+    prices = prices_all[symbols]  # only portfolio symbols
+
+    # Rebalancing orders, simulated on the prices already loaded
+    orders, allocations = rolling_rebalance(prices, window, period, start_val)
+    portvals = marketsim.compute_portvals(start_date, end_date, orders, start_val, prices=prices_all)
+    port_val = portvals["_VALUE"][prices.index[window]:]
+
+    # Get portfolio statistics (note: std_daily_ret = volatility)
+    cum_ret, avg_daily_ret, std_daily_ret, sharpe_ratio = get_portfolio_stats(port_val)
+
+    # Print statistics
+    print "Start Date:", start_date
+    print "End Date:", end_date
+    print "Symbols:", symbols
+    print "Rebalancings:", allocations.shape[0]
+    print "Last allocations:", allocations.values[-1]
+    print "Sharpe Ratio:", sharpe_ratio
+    print "Volatility (stdev of daily returns):", std_daily_ret
+    print "Average Daily Return:", avg_daily_ret
+    print "Cumulative Return:", cum_ret
+    print "Final Portfolio Value:", port_val[-1]
+
+
 def optimize_portfolio(start_date, end_date, symbols):
     """Simulate and optimize portfolio allocations."""
     # Read in adjusted closing prices for given symbols, date range
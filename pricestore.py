@@ -0,0 +1,156 @@
+"""MLT: Columnar price store.
+
+Prices for all symbols are kept in one binary .npy file per field
+(symbols x dates, float64) that can be memory mapped, with a shared date
+index (dates.npy) and a symbol directory (symbols.csv). Slicing a window
+of dates for a few symbols only touches those rows of the files, no text
+is parsed.
+
+Build or refresh the store from the CSV files in data/ with:
+
+    python pricestore.py [data_dir] [store_dir]
+"""
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+from util import symbol_to_path
+
+FIELDS = ["Open", "High", "Low", "Close", "Volume", "Adj Close"]
+STORE_DIR = os.path.join(".", "data", "store")
+
+#Seconds a CSV file modification time may exceed the saved one (rounding)
+MTIME_TOLERANCE = 1e-3
+
+#Stores already opened, by directory, to avoid re-reading the directory
+_open_stores = {}
+
+
+def field_to_path(field, store_dir=STORE_DIR):
+    """Return the binary file path of a price field."""
+    return os.path.join(store_dir, "{}.npy".format(field.lower().replace(" ", "_")))
+
+
+class PriceStore(object):
+
+    def __init__(self, store_dir=STORE_DIR, base_dir=os.path.join(".", "data")):
+        self.store_dir = store_dir
+        self.base_dir = base_dir
+
+        #Shared date index and symbol directory
+        self.dates = pd.DatetimeIndex(np.load(os.path.join(store_dir, "dates.npy")))
+        directory = pd.read_csv(os.path.join(store_dir, "symbols.csv"))
+        self.symbols = list(directory["Symbol"])
+        self.rows = dict(zip(self.symbols, range(len(self.symbols))))
+        self.mtimes = dict(zip(self.symbols, directory["Mtime"]))
+        self.fields = {}
+
+    def field(self, field):
+        """Return the memory mapped (symbols x dates) array of a field."""
+        if field not in self.fields:
+            self.fields[field] = np.load(field_to_path(field, self.store_dir), mmap_mode="r")
+        return self.fields[field]
+
+    def has_symbols(self, symbols):
+        """Check all symbols are in the store and their CSV files have not
+        been modified since the store was built."""
+        for symbol in symbols:
+            if symbol not in self.rows:
+                return False
+            csv_file = symbol_to_path(symbol, self.base_dir)
+            if os.path.isfile(csv_file) and \
+                    os.path.getmtime(csv_file) > self.mtimes[symbol] + MTIME_TOLERANCE:
+                return False
+        return True
+
+    def window(self, symbol, start, end, field="Adj Close"):
+        """Read a field of one symbol between start and end (inclusive),
+        on the dates of the store."""
+        first = self.dates.searchsorted(pd.Timestamp(start), side="left")
+        last = self.dates.searchsorted(pd.Timestamp(end), side="right")
+        values = self.field(field)[self.rows[symbol], first:last]
+        return pd.Series(np.array(values), index=self.dates[first:last], name=symbol)
+
+
+def open_price_store(store_dir=STORE_DIR, base_dir=os.path.join(".", "data")):
+    """Return the price store in store_dir, or None if it was not built."""
+    directory_file = os.path.join(store_dir, "symbols.csv")
+    if not os.path.isfile(directory_file):
+        return None
+
+    #Reopen the store if it has been rebuilt
+    key = (os.path.abspath(store_dir), os.path.abspath(base_dir))
+    mtime = os.path.getmtime(directory_file)
+    if key not in _open_stores or _open_stores[key][0] != mtime:
+        _open_stores[key] = (mtime, PriceStore(store_dir, base_dir))
+    return _open_stores[key][1]
+
+
+def build_price_store(symbols=None, base_dir=os.path.join(".", "data"), store_dir=STORE_DIR):
+    """Convert the CSV price files into a columnar price store.
+
+    Parameters
+    ----------
+        symbols: symbols to import (default: every price CSV file in base_dir)
+        base_dir: directory with the CSV files
+        store_dir: directory of the price store, rebuilt from scratch
+
+    Returns
+    -------
+        symbols: list of imported symbols
+    """
+    if symbols is None:
+        symbols = sorted(f[:-4] for f in os.listdir(base_dir) if f.endswith(".csv"))
+
+    #Parse every CSV file once, skipping files that are not price series
+    frames = {}
+    mtimes = {}
+    for symbol in symbols:
+        csv_file = symbol_to_path(symbol, base_dir)
+        columns = pd.read_csv(csv_file, nrows=0).columns
+        if "Date" not in columns or "Adj Close" not in columns:
+            continue
+        df = pd.read_csv(csv_file, index_col="Date", parse_dates=True, na_values=["nan"])
+        frames[symbol] = df.sort_index()
+        mtimes[symbol] = os.path.getmtime(csv_file)
+    symbols = [symbol for symbol in symbols if symbol in frames]
+
+    #Shared date index, union of all symbol dates
+    dates = pd.DatetimeIndex([])
+    for symbol in symbols:
+        dates = dates.union(frames[symbol].index)
+
+    #Remove the symbol directory first so the store is not read while rebuilt
+    directory_file = os.path.join(store_dir, "symbols.csv")
+    if os.path.isfile(directory_file):
+        os.remove(directory_file)
+    elif not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    np.save(os.path.join(store_dir, "dates.npy"), dates.values)
+
+    #One (symbols x dates) file per field, so each symbol series is contiguous
+    for field in FIELDS:
+        data = np.lib.format.open_memmap(field_to_path(field, store_dir), mode="w+",
+                                         dtype=np.float64, shape=(len(symbols), len(dates)))
+        for i, symbol in enumerate(symbols):
+            if field in frames[symbol].columns:
+                data[i, :] = frames[symbol][field].reindex(dates).values
+            else:
+                data[i, :] = np.nan
+        data.flush()
+        del data
+
+    #The symbol directory is written last, it marks the store as complete
+    directory = pd.DataFrame({"Symbol": symbols, "Mtime": [mtimes[s] for s in symbols]},
+                             columns=["Symbol", "Mtime"])
+    directory.to_csv(directory_file, index=False, float_format="%.6f")
+
+    return symbols
+
+
+if __name__ == "__main__":
+    base_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(".", "data")
+    store_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(base_dir, "store")
+    imported = build_price_store(base_dir=base_dir, store_dir=store_dir)
+    print "Imported {} symbols into {}".format(len(imported), store_dir)
@@ -0,0 +1,170 @@
+"""Batch backtests of the Bollinger Bands strategy"""
+import os
+import sys
+import multiprocessing
+from multiprocessing import sharedctypes
+import numpy as np
+import pandas as pd
+
+from portfolio.analysis import get_portfolio_stats
+from util import get_data
+from marketsim import simulate_orders
+from strategies.bollinger import bollinger_indicator, bollinger_strategy, generate_trades
+
+#Columns of the results table, a run is identified by the first three
+RESULT_COLUMNS = ["Symbol", "Window", "DevFactor", "Trades", "CumReturn",
+                  "AvgDailyReturn", "StdDailyReturn", "Sharpe", "MaxDrawdown"]
+
+#Prices shared with the worker processes, set by init_worker
+worker_data = {}
+
+def init_worker(shared, shape, index, symbols):
+    """Initialize a worker process with the shared, read-only price matrix"""
+    worker_data["prices"] = np.frombuffer(shared).reshape(shape)
+    worker_data["index"] = index
+    worker_data["symbols"] = symbols
+
+def backtest(prices, window_length, dev_factor, start_val):
+    """Backtest of the Bollinger strategy on one symbol
+
+    Parameters
+    ----------
+        prices: Series with the prices of the symbol, named after it
+        window_length: Number of samples for the moving average
+        dev_factor: Number of standard deviation around the moving average
+        start_val: initial cash for the strategy
+
+    Returns
+    -------
+        result: dictionary with the RESULT_COLUMNS of the run
+    """
+    result = dict.fromkeys(RESULT_COLUMNS, np.nan)
+    result.update({"Symbol": prices.name, "Window": window_length, "DevFactor": dev_factor})
+    prices = prices.dropna()
+    if prices.shape[0] < 2:
+        return result
+
+    #Indicator -> signals -> orders -> simulation, all in memory
+    bollinger = bollinger_indicator(prices, window_length, dev_factor, cache=None)
+    signal = bollinger_strategy(bollinger)
+    orders = generate_trades(prices.name, start_val, bollinger, signal)
+    result["Trades"] = orders.shape[0]
+    if orders.shape[0] == 0:
+        portvals = pd.Series(float(start_val), index=prices.index)
+    else:
+        try:
+            portvals = simulate_orders(orders, prices.to_frame(), float(start_val))["_VALUE"]
+        except ValueError:
+            return result #Leverage limit reached, no stats
+
+    cum_ret, avg_daily_ret, std_daily_ret, sharpe_ratio = get_portfolio_stats(portvals)
+    result.update({"CumReturn": cum_ret, "AvgDailyReturn": avg_daily_ret,
+                   "StdDailyReturn": std_daily_ret, "Sharpe": sharpe_ratio,
+                   "MaxDrawdown": (portvals / portvals.cummax() - 1).min()})
+    return result
+
+def backtest_task(task):
+    """Run the backtests of one symbol in a worker, task is (column, runs, start_val)"""
+    column, runs, start_val = task
+    prices = pd.Series(worker_data["prices"][:, column], index=worker_data["index"],
+                       name=worker_data["symbols"][column])
+    return [backtest(prices, window_length, dev_factor, start_val)
+            for window_length, dev_factor in runs]
+
+def run_backtests(symbols, start_date, end_date, windows=[20], dev_factors=[2],
+                  start_val=10000, n_jobs=1, results_file=None, verbose=True):
+    """Backtest the Bollinger strategy over symbols and parameter combinations
+
+    Runs are spread by symbol over a pool of n_jobs processes, which share the
+    price matrix read-only. With a results_file, each finished run is appended
+    to it and the runs it already holds are skipped, so an interrupted batch
+    resumes where it stopped.
+
+    Parameters
+    ----------
+        symbols: list of symbols to backtest
+        start_date, end_date: period of the backtests
+        windows: list of moving average windows
+        dev_factors: list of numbers of standard deviations of the bands
+        start_val: initial cash of each run
+        n_jobs: number of processes, 0 for one per CPU
+        results_file: CSV file collecting the results, None to keep them in memory
+        verbose: print the progress
+
+    Returns
+    -------
+        results: DataFrame with the RESULT_COLUMNS of every run
+    """
+    runs = [(window_length, dev_factor) for window_length in windows for dev_factor in dev_factors]
+
+    #Results of a previous, interrupted, batch
+    results = []
+    done = set()
+    if results_file is not None and os.path.exists(results_file):
+        previous = pd.read_csv(results_file)
+        done = set(zip(previous["Symbol"], previous["Window"], previous["DevFactor"]))
+        requested = set((symbol, run[0], run[1]) for symbol in symbols for run in runs)
+        results = [result for result in previous.to_dict("records")
+                   if (result["Symbol"], result["Window"], result["DevFactor"]) in requested]
+
+    tasks = []
+    for column, symbol in enumerate(symbols):
+        todo = [run for run in runs if (symbol, run[0], run[1]) not in done]
+        if todo:
+            tasks.append((column, todo, start_val))
+    total = sum(len(task[1]) for task in tasks)
+    if verbose:
+        print "Backtests: {} runs to do, {} already done".format(total, len(results))
+    if total == 0:
+        return pd.DataFrame(results, columns=RESULT_COLUMNS)
+
+    #Prices are loaded once and shared with the workers
+    stock_prices = get_data(symbols, pd.date_range(start_date, end_date))[symbols]
+    shared = sharedctypes.RawArray('d', int(np.prod(stock_prices.shape)))
+    np.frombuffer(shared).reshape(stock_prices.shape)[...] = stock_prices.values
+    initargs = (shared, stock_prices.shape, stock_prices.index, list(symbols))
+
+    n_jobs = n_jobs if n_jobs > 0 else multiprocessing.cpu_count()
+    if n_jobs > 1:
+        pool = multiprocessing.Pool(n_jobs, init_worker, initargs)
+        completed = pool.imap_unordered(backtest_task, tasks)
+    else:
+        pool = None
+        init_worker(*initargs)
+        completed = (backtest_task(task) for task in tasks)
+
+    try:
+        count = 0
+        for task_results in completed:
+            results.extend(task_results)
+            count += len(task_results)
+            if results_file is not None:
+                new_file = not os.path.exists(results_file)
+                pd.DataFrame(task_results, columns=RESULT_COLUMNS).to_csv(
+                    results_file, mode="a", header=new_file, index=False)
+            if verbose:
+                print "Backtests: {}/{} runs done ({})".format(count, total, task_results[0]["Symbol"])
+                sys.stdout.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    return pd.DataFrame(results, columns=RESULT_COLUMNS)
+
+
+def test_run():
+    """Driver function."""
+
+    # Define input parameters
+    start_date = '2007-12-31'
+    end_date = '2009-12-31'
+    stock_symbol = ["IBM", "AAPL", "GE", "GLD", "XOM", "GOOG"]
+
+    results = run_backtests(stock_symbol, start_date, end_date, windows=[10, 20, 30],
+                            dev_factors=[1.5, 2, 2.5], n_jobs=0,
+                            results_file=os.path.join("output", "backtests.csv"))
+    print results.sort_values("Sharpe", ascending=False).head(10)
+
+if __name__ == "__main__":
+    test_run()
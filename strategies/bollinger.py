@@ -1,13 +1,14 @@
 """MLT - MC2 - P2 Bollinger Bands Strategy"""
-import os
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
 from portfolio.analysis import get_portfolio_stats, get_portfolio_value, plot_normalized_data
 from util import get_data
+from indicators.IndicatorCache import indicator_cache
 import marketsim
 
-def bollinger_indicator(quotation_serie, window_length = 20, dev_factor=2):
+def bollinger_indicator(quotation_serie, window_length = 20, dev_factor=2, cache=indicator_cache):
     """Bollinger band indicator
     
     Return a dataframe containing the stock quotation as well as the moving
@@ -18,27 +19,101 @@ def bollinger_indicator(quotation_serie, window_length = 20, dev_factor=2):
         quotation_serie: Series with stock prices
         window_length: Number of samples for the moving average
         dev_factor: Number of standard deviation around the moving average
+        cache: IndicatorCache memoizing the result, None to always compute it
     
     Returns
     -------
         bollinger_indicator: data frame with the moving average and the 
         standard deviation band    
     """
+    if cache is not None:
+        return cache.get("bollinger_indicator", (window_length, dev_factor), quotation_serie,
+                         lambda serie: bollinger_indicator(serie, window_length, dev_factor, cache=None))
+    
     #Compute rolling mean and std    
     ma = pd.rolling_mean(quotation_serie, window = window_length)
     sd = pd.rolling_std(quotation_serie, window = window_length)
     
     #Create bollinger band
-    bollinger_indicator = pd.DataFrame(index = quotation_serie.index, 
-                                       columns = ["Price", "MA", "UpperBand", "LowerBand"] )
+    bollinger_df = pd.DataFrame(index = quotation_serie.index, 
+                                columns = ["Price", "MA", "UpperBand", "LowerBand"] )
+    
+    bollinger_df["Price"] = quotation_serie    
+    bollinger_df["MA"] = ma    
+    bollinger_df["UpperBand"] = ma + sd *  dev_factor
+    bollinger_df["LowerBand"] = ma - sd *  dev_factor    
+    
+    return bollinger_df
+    
+#Trading states of the bollinger strategy, coded by their position
+STATES = ["HOLD", "LONG_ENTRY", "LONG", "LONG_EXIT", "SHORT_ENTRY", "SHORT", "SHORT_EXIT"]
+HOLD, LONG_ENTRY, LONG, LONG_EXIT, SHORT_ENTRY, SHORT, SHORT_EXIT = range(len(STATES))
+
+def transition_table():
+    """Transitions of the state machine
+    
+    Returns
+    -------
+        transitions: array giving the next state from the current state and
+        the condition code of the day, sum of 1 if the price crosses the upper
+        band downwards, 2 if it crosses the lower band upwards, 4 if it is
+        above or at the moving average and 8 if it is below or at it.
+    """
+    transitions = np.empty((len(STATES), 16), dtype=int)
+    for condition in range(16):
+        cross_upper, cross_lower = condition & 1, condition & 2
+        above_ma, below_ma = condition & 4, condition & 8
+        transitions[HOLD, condition] = SHORT_ENTRY if cross_upper else LONG_ENTRY if cross_lower else HOLD
+        transitions[LONG_ENTRY, condition] = transitions[LONG, condition] = LONG_EXIT if above_ma else LONG
+        transitions[SHORT_ENTRY, condition] = transitions[SHORT, condition] = SHORT_EXIT if below_ma else SHORT
+        transitions[LONG_EXIT, condition] = SHORT_ENTRY if cross_upper else HOLD
+        transitions[SHORT_EXIT, condition] = LONG_ENTRY if cross_lower else HOLD
+    return transitions
+
+TRANSITIONS = transition_table()
+
+def bollinger_states(price, ma, upper, lower):
+    """Run the bollinger state machine on arrays
     
-    bollinger_indicator["Price"] = quotation_serie    
-    bollinger_indicator["MA"] = ma    
-    bollinger_indicator["UpperBand"] = ma + sd *  dev_factor
-    bollinger_indicator["LowerBand"] = ma - sd *  dev_factor    
+    Parameters
+    ----------
+        price, ma, upper, lower: arrays of the prices, moving averages and
+        bands, one row per date and one column per symbol (or 1-D for one
+        symbol)
     
-    return bollinger_indicator
+    Returns
+    -------
+        states: integer array of the same shape with the index in STATES of
+        the state of each date, -1 for the first date that has no signal
     
+    """
+    price, ma, upper, lower = [np.asarray(a, dtype=float) for a in (price, ma, upper, lower)]
+    shape = price.shape
+    if price.ndim == 1:
+        price, ma, upper, lower = [a[:, np.newaxis] for a in (price, ma, upper, lower)]
+    states = np.empty(price.shape, dtype=int)
+    if price.shape[0] == 0:
+        return states.reshape(shape)
+    
+    #Conditions of the transitions, comparisons with NaN are false
+    with np.errstate(invalid="ignore"):
+        conditions = (1 * ((price[:-1] > upper[:-1]) & (price[1:] <= upper[1:]))
+                      + 2 * ((price[:-1] < lower[:-1]) & (price[1:] >= lower[1:]))
+                      + 4 * (price[1:] >= ma[1:])
+                      + 8 * (price[1:] <= ma[1:]))
+    
+    #Only the state machine itself is sequential, for all symbols at once
+    states[0] = -1
+    state = np.zeros(price.shape[1], dtype=int) + HOLD
+    for t in range(0, conditions.shape[0]):
+        state = TRANSITIONS[state, conditions[t]]
+        states[t + 1] = state
+    return states.reshape(shape)
+
+def state_names(states):
+    """Names of integer coded states, NaN for -1"""
+    return np.array([np.nan] + STATES, dtype=object)[np.asarray(states) + 1]
+
 def bollinger_strategy( bollinger_df ):
     """Bollinger Band strategy
     
@@ -55,103 +130,80 @@ def bollinger_strategy( bollinger_df ):
         of type Long entry, long, long exit, short entry, short, short exit, hold.
     
     """
+    states = bollinger_states(bollinger_df["Price"].values, bollinger_df["MA"].values,
+                              bollinger_df["UpperBand"].values, bollinger_df["LowerBand"].values)
+    return pd.Series(state_names(states), index=bollinger_df.index, name="TradingSignal")
     
-    #Add a column with the trading signal
-    signal = pd.Series(index=bollinger_df.index, dtype=str, name="TradingSignal")
-    indicator = bollinger_df #Alias for bollinger data frame
-    state = "HOLD"
-    
-    yesterday = bollinger_df.index[0]
-    for date in bollinger_df.index[1:]:        
-               
-        #Transitions of the state machine
-        if state == "HOLD":
-            if (indicator["Price"][yesterday] > indicator["UpperBand"][yesterday] ) \
-            and (indicator["Price"][date] <= indicator["UpperBand"][date] ):
-                state = "SHORT_ENTRY"
-            elif (indicator["Price"][yesterday] < indicator["LowerBand"][yesterday]) \
-            and  (indicator["Price"][date] >= indicator["LowerBand"][date] ) :
-                state = "LONG_ENTRY"
-            else:
-                state = "HOLD"
-                    
-        elif state == "LONG_ENTRY" or state == "LONG":
-            if (indicator["Price"][date] >= indicator["MA"][date] ):
-                state = "LONG_EXIT"  
-            else:
-                state = "LONG"
-
-        elif state == "SHORT_ENTRY" or state == "SHORT":
-            if (indicator["Price"][date] <= indicator["MA"][date] ):
-                state = "SHORT_EXIT"
-            else:
-                state = "SHORT"
-                
-        elif state == "LONG_EXIT":
-            if (indicator["Price"][yesterday] > indicator["UpperBand"][yesterday]) \
-            and (indicator["Price"][date] <= indicator["UpperBand"][date] ):
-                state = "SHORT_ENTRY"
-            else:
-                state = "HOLD"
-                
-        elif state == "SHORT_EXIT":
-            if (indicator["Price"][yesterday] < indicator["LowerBand"][yesterday]) \
-            and (indicator["Price"][date] >= indicator["LowerBand"][date] ):
-                state = "LONG_ENTRY"
-            else:
-                state = "HOLD"
-                
-        else:
-            raise "Unknown state"
-            
-        #Update trading state 
-        signal[date] = state
-        yesterday = date
-    
-    return signal
+def bollinger_signals(stock_prices, window_length = 20, dev_factor=2):
+    """Bollinger Band strategy on several symbols at once
+    
+    Parameters
+    ----------
+        stock_prices: DataFrame with one column of prices per symbol
+        window_length: Number of samples for the moving average
+        dev_factor: Number of standard deviation around the moving average
+    
+    Returns
+    -------
+        trading_signal: DataFrame with the trading signal of each symbol, the
+        same as bollinger_strategy gives for each of them.
+    
+    """
+    ma = pd.rolling_mean(stock_prices, window = window_length)
+    sd = pd.rolling_std(stock_prices, window = window_length)
+    states = bollinger_states(stock_prices.values, ma.values,
+                              (ma + sd * dev_factor).values, (ma - sd * dev_factor).values)
+    return pd.DataFrame(state_names(states), index=stock_prices.index, columns=stock_prices.columns)
     
 def generate_trades(stock, cash, bollinger_df, bollinger_strg):
     """Generate trading orders according to the bollinger strategy
     
+    Each entry trades as many stocks as the cash buys at the price of the
+    day, the following exit trades back the same quantity.
+    
     Parameters
     ----------
+        stock: symbol, or list of symbols when bollinger_strg is a DataFrame
         bollinger_df: Bollinger indicator, as returned by bollinger_indicator
-        function.
-        bollinger_strg: Trading signal with the bollinger strategy
+        function. For several symbols, DataFrame with their prices.
+        bollinger_strg: Trading signal with the bollinger strategy, or a
+        DataFrame of signals as returned by bollinger_signals
     
     Returns
     -------
-        Dataframe with the trading orders of the strategy
+        Dataframe with the trading orders of the strategy, by date (then in
+        the order of the symbols)
     
     """    
-    orders = pd.DataFrame(columns = ["Date","Symbol","Order","Shares"] )
-    
-    #For each date    
-    quantity = 0.0 #number of stocks 
-    for date in bollinger_strg.index:
-        signal = bollinger_strg[date]
-
-        #LONG ENTRY generates a buying signal        
-        if signal == "LONG_ENTRY":
-            quantity = int( float( cash ) / bollinger_df["Price"][date] )
-            order = {'Date' : date, 'Symbol' : stock, 'Order' : "BUY", 'Shares' : quantity}
-            orders = orders.append(order, ignore_index=True)
-        #LONG_EXIT generates a sell signal of the same quantity of stock
-        elif signal == "LONG_EXIT":
-            order = {'Date' : date, 'Symbol' : stock, 'Order' : "SELL", 'Shares' : quantity}
-            orders = orders.append(order, ignore_index=True)
-        #SHORT_ENTRY generates a sell signal
-        elif signal == "SHORT_ENTRY":
-            quantity = int( float( cash ) / bollinger_df["Price"][date] )
-            order = {'Date' : date, 'Symbol' : stock, 'Order' : "SELL", 'Shares' : quantity}
-            orders = orders.append(order, ignore_index=True)
-        #SHORT_EXIT generates a buy signal of the same quantity of stock
-        elif signal == "SHORT_EXIT":
-            order = {'Date' : date, 'Symbol' : stock, 'Order' : "BUY", 'Shares' : quantity}
-            orders = orders.append(order, ignore_index=True)
-        else:
-            pass 
-    
+    if isinstance(bollinger_strg, pd.Series):
+        stocks = [stock]
+        signal = bollinger_strg.values[:, np.newaxis]
+        price = bollinger_df["Price"].values[:, np.newaxis]
+    else:
+        stocks = list(stock)
+        signal = bollinger_strg[stocks].values
+        price = bollinger_df[stocks].values
+    
+    #LONG ENTRY and SHORT_EXIT generate a buying signal, SHORT_ENTRY and
+    #LONG_EXIT a sell signal
+    entries = (signal == "LONG_ENTRY") | (signal == "SHORT_ENTRY")
+    exits = (signal == "LONG_EXIT") | (signal == "SHORT_EXIT")
+    buys = (signal == "LONG_ENTRY") | (signal == "SHORT_EXIT")
+    
+    #Entries buy int(cash / price) stocks, exits carry forward the quantity
+    #of the previous entry
+    with np.errstate(divide="ignore", invalid="ignore"):
+        quantity = np.where(entries, np.trunc(float(cash) / price.astype(float)), np.nan)
+    quantity = pd.DataFrame(quantity).ffill().fillna(0.0).values
+    
+    dates, symbols = np.nonzero(entries | exits)
+    if len(dates) == 0:
+        return pd.DataFrame(columns = ["Date","Symbol","Order","Shares"] )
+    orders = pd.DataFrame({"Date": bollinger_strg.index[dates],
+                           "Symbol": np.array(stocks, dtype=object)[symbols],
+                           "Order": np.where(buys[dates, symbols], "BUY", "SELL").astype(object),
+                           "Shares": quantity[dates, symbols]},
+                          columns = ["Date","Symbol","Order","Shares"] )
     return orders
     
     
@@ -217,17 +269,15 @@ def test_run():
     bollinger = bollinger_indicator(stock_prices[ stock_symbol[0] ])    
     trading_signal = bollinger_strategy( bollinger )
 
-    #Get orders and save to csv order file
+    #Get orders
     orders = generate_trades(stock_symbol[0], start_val, bollinger, trading_signal)
-    orders_file = os.path.join("orders", "bollinger.csv")    
-    orders.to_csv(orders_file, index=False)
     
     #Plot strategy
     plot_bollinger_strategy( bollinger, trading_signal )
     
     #Measure performance of strategy
-    #Process orders
-    portvals = marketsim.compute_portvals(start_date, end_date, orders_file, start_val)
+    #Process orders, on the prices already loaded
+    portvals = marketsim.compute_portvals(start_date, end_date, orders, start_val, prices=stock_prices)
     portvals = portvals[ "_VALUE" ]
     
     # Get portfolio stats
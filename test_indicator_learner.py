@@ -6,7 +6,7 @@ import os
 from util import get_data, plot_data
 from portfolio.analysis import get_portfolio_value, get_portfolio_stats, plot_normalized_data
 from learners import BagLearner
-from indicators import Bollinger, Momentum, Volatility
+from indicators import Bollinger, Momentum, Volatility, Pipeline
 
 def test_run():
     """Driver function."""
@@ -30,22 +30,16 @@ def test_run():
     print "Learning set from ", learning_dates[0], " to ", learning_dates[-1]
     print "Test set from ", test_dates[0], " to ", test_dates[-1]
     
-    #Get indicators
-    bollinger_ind = Bollinger.Bollinger()
-    momentum_ind = Momentum.Momentum()
-    volatility_ind = Volatility.Volatility()    
-    bollinger_ind.addPriceSeries( stock_prices )
-    momentum_ind.addPriceSeries( stock_prices )
-    volatility_ind.addPriceSeries( stock_prices )
+    #Get indicators, computed together in one pass
+    pipeline = Pipeline.Pipeline([ Bollinger.Bollinger(), Momentum.Momentum(), Volatility.Volatility() ])
+    pipeline.addPriceSeries( stock_prices )
     
     #Get data to be predicted
     future_return = stock_prices / stock_prices.shift( 5 ) - 1
     future_return.columns = ['Prediction']
     
     #Merge in a dataframe, combining the three predictors
-    data_set = future_return.join(bollinger_ind.getIndicator(), how='inner' )
-    data_set = data_set.join(momentum_ind.getIndicator(), how='inner')
-    data_set = data_set.join(volatility_ind.getIndicator(), how='inner')    
+    data_set = future_return.join(pipeline.getFeatures(), how='inner' )
     data_set.dropna(inplace=True)
     #print learning_set   
         
@@ -0,0 +1,42 @@
+"""
+Test the KNN learner searches give the same results.
+"""
+import numpy as np
+import learners.KNNLearner as knn
+
+def test_knn_methods_with_missing_values():
+    random = np.random.RandomState(0)
+    trainX = random.uniform(-1, 1, size=(300, 3))
+    trainY = trainX.sum(axis = 1)
+    #Rows with missing values, as the warm-up rows of rolling indicators
+    trainX[random.choice(300, 20, replace = False), random.randint(0, 3, size = 20)] = np.nan
+    testX = random.uniform(-1, 1, size=(50, 3))
+    testX[0, 1] = np.nan
+
+    estimates = {}
+    for method in ["brute", "kdtree", "batch"]:
+        learner = knn.KNNLearner(k = 3, method = method, leaf_size = 8)
+        learner.addEvidence(trainX, trainY)
+        estimates[method] = learner.query(testX)
+    assert np.allclose(estimates["kdtree"], estimates["brute"], equal_nan = True)
+    assert np.allclose(estimates["batch"][1:], estimates["brute"][1:])
+    assert not np.isnan(estimates["kdtree"][1:]).any()
+
+    #A learner with more neighbors than complete rows uses the missing ones last
+    for method in ["brute", "kdtree"]:
+        learner = knn.KNNLearner(k = 290, method = method)
+        learner.addEvidence(trainX, trainY)
+        estimates[method] = learner.query(testX[1:5])
+    assert np.allclose(estimates["kdtree"], estimates["brute"], equal_nan = True)
+
+    #Bags of rows with counts
+    rows, counts = np.unique(random.choice(300, 180), return_counts = True)
+    for method in ["brute", "kdtree"]:
+        learner = knn.KNNLearner(k = 3, method = method)
+        learner.addEvidence(trainX, trainY, rows, counts)
+        estimates[method] = learner.query(testX)
+    assert np.allclose(estimates["kdtree"], estimates["brute"], equal_nan = True)
+
+if __name__=="__main__":
+    test_knn_methods_with_missing_values()
+    print "KNN tree, brute force and batch searches with missing values: OK"
@@ -0,0 +1,42 @@
+"""
+Test saving, loading and training again a bagging learner.
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+import learners.BagLearner as bag
+from learners.Persistence import load_learner
+
+def test_bag_learner_retrain_after_load():
+    random = np.random.RandomState(0)
+    trainX = random.uniform(-1, 1, size=(200, 2))
+    trainY = trainX[:, 0] - 2 * trainX[:, 1]
+    testX = random.uniform(-1, 1, size=(3, 2))
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "bag.bin")
+        learner = bag.BagLearner(bags = 4, n_jobs = 2, seed = 1)
+        learner.addEvidence(trainX, trainY)
+        saved = learner.query(testX)
+        learner.save(path)
+
+        #The loaded learner gives the saved predictions, queried by the workers
+        loaded = load_learner(path)
+        assert loaded.path == path
+        assert np.allclose(loaded.query(testX), saved)
+
+        #Trained again, the workers must query the new bags, not the saved file
+        loaded.addEvidence(trainX, -10 * trainY)
+        assert loaded.path is None
+        retrained = bag.BagLearner(bags = 4, n_jobs = 1, seed = 1)
+        retrained.addEvidence(trainX, -10 * trainY)
+        assert np.allclose(loaded.query(testX), retrained.query(testX))
+        assert not np.allclose(loaded.query(testX), saved)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__=="__main__":
+    test_bag_learner_retrain_after_load()
+    print "BagLearner save, load and retrain: OK"
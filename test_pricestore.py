@@ -0,0 +1,43 @@
+"""
+Test building and reading the columnar price store.
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from pricestore import PriceStore, build_price_store
+
+def test_build_price_store():
+    base_dir = tempfile.mkdtemp()
+    try:
+        dates = pd.bdate_range("2010-01-01", "2010-03-31")
+        for symbol in ["IBM", "GE"]:
+            prices = pd.DataFrame({"Adj Close": np.random.rand(len(dates))},
+                                  index=pd.Index(dates, name="Date"))
+            prices.to_csv(os.path.join(base_dir, symbol + ".csv"))
+            #Modification times with more digits than str() keeps
+            os.utime(os.path.join(base_dir, symbol + ".csv"), (1792239321.1234, 1792239321.1234))
+        #Learner data files without dates are skipped
+        shutil.copy(os.path.join("data", "simple.csv"), base_dir)
+
+        store_dir = os.path.join(base_dir, "store")
+        assert build_price_store(base_dir=base_dir, store_dir=store_dir) == ["GE", "IBM"]
+
+        #A freshly built store is up to date
+        store = PriceStore(store_dir, base_dir)
+        assert store.has_symbols(["GE", "IBM"])
+        window = store.window("IBM", "2010-02-01", "2010-02-28")
+        expected = pd.read_csv(os.path.join(base_dir, "IBM.csv"), index_col="Date",
+                               parse_dates=True)["Adj Close"]["2010-02-01":"2010-02-28"]
+        assert np.allclose(window.values, expected.values)
+
+        #A CSV file modified after the build is read again
+        os.utime(os.path.join(base_dir, "IBM.csv"), (1792239400.0, 1792239400.0))
+        assert not store.has_symbols(["IBM"])
+    finally:
+        shutil.rmtree(base_dir)
+
+if __name__ == "__main__":
+    test_build_price_store()
+    print "Price store build: OK"
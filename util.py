@@ -1,7 +1,11 @@
 """MLT: Utility code."""
 import os
+import tempfile
+import warnings
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
 import pandas as pd
-import pandas.io.data
 import matplotlib.pyplot as plt
 
 def symbol_to_path(symbol, base_dir=os.path.join(".", "data")):
@@ -9,32 +13,290 @@ def symbol_to_path(symbol, base_dir=os.path.join(".", "data")):
     return os.path.join(base_dir, "{}.csv".format(str(symbol)))
 
 
-def get_data(symbols, dates, addSPY=True):
-    """Read stock data (adjusted close) for given symbols from CSV files.
-    TODO: We should always download the file from the database   
+class LRUCache(object):
+    """Bounded in-process cache of pandas objects.
+
+    Entries are kept from least to most recently used. When they use more
+    than max_bytes, evict drops the least recently used ones. Subclasses
+    measure their entries with entry_nbytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() #key -> entry
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def entry_nbytes(self, entry):
+        """Memory used by an entry."""
+        return series_nbytes(entry)
+
+    def touch(self, key):
+        """Return the entry of a key, marked as most recently used."""
+        entry = self.entries.pop(key)
+        self.entries[key] = entry
+        return entry
+
+    def remember(self, key, entry):
+        """Add or replace the entry of a key, as most recently used."""
+        if key in self.entries:
+            self.nbytes -= self.entry_nbytes(self.entries.pop(key))
+        self.entries[key] = entry
+        self.nbytes += self.entry_nbytes(entry)
+
+    def evict(self):
+        """Drop least recently used entries until within max_bytes."""
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            self.nbytes -= self.entry_nbytes(self.entries.popitem(last=False)[1])
+
+    def clear(self):
+        """Drop all the entries and reset the counters."""
+        self.entries.clear()
+        self.nbytes = self.hits = self.misses = 0
+
+    def cache_info(self):
+        """Return hits, misses and memory use."""
+        return {"hits": self.hits, "misses": self.misses,
+                "nbytes": self.nbytes, "max_bytes": self.max_bytes}
+
+
+class PriceCache(LRUCache):
+    """Bounded in-process cache of adjusted close prices, keyed by symbol.
+
+    Each symbol keeps its price series and the date ranges it is known to
+    cover. Requests inside a covered range are served from memory, other
+    requests are loaded and merged into the cached series. When the cached
+    series use more than max_bytes the least recently used symbols are
+    evicted.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        #Entries are symbol -> (prices, covered ranges)
+        LRUCache.__init__(self, max_bytes)
+
+    def entry_nbytes(self, entry):
+        return series_nbytes(entry[0])
+
+    def get(self, symbol, start, end, loader):
+        """Return the prices of a symbol between start and end (inclusive).
+
+        Parameters
+        ----------
+            symbol: ticker symbol
+            start, end: date range to return
+            loader: function loader(symbol, start, end) called on a miss,
+            returning the prices and the (start, end) range they cover
+
+        Returns
+        -------
+            prices: Series with the prices of the symbol within the range
+        """
+        return self.get_many([symbol], start, end, loader)[0]
+
+    def get_many(self, symbols, start, end, loader, n_jobs=1, processes=False):
+        """Return the prices of several symbols between start and end.
+
+        Symbols that are not cached are loaded with n_jobs workers, threads
+        by default or processes if processes is True (loader must then be
+        a module level function).
+
+        Returns
+        -------
+            prices: list of Series, one per symbol
+        """
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        missing = [symbol for symbol in symbols if not self.covers(symbol, start, end)]
+        self.hits += len(symbols) - len(missing)
+        self.misses += len(missing)
+
+        #Load the misses, in parallel if requested
+        tasks = [(loader, symbol, start, end) for symbol in missing]
+        if n_jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(n_jobs) if processes else ThreadPool(n_jobs)
+            try:
+                loaded = pool.map(load_task, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            loaded = [load_task(task) for task in tasks]
+
+        for symbol, (prices, covered) in zip(missing, loaded):
+            self.merge(symbol, prices, covered)
+
+        #Most recently used symbols are kept at the end
+        result = [self.touch(symbol)[0][start:end] for symbol in symbols]
+
+        self.evict()
+        return result
+
+    def covers(self, symbol, start, end):
+        """Check the cached prices of a symbol cover start to end."""
+        ranges = self.entries.get(symbol, (None, []))[1]
+        return any(r_start <= start and end <= r_end for r_start, r_end in ranges)
+
+    def merge(self, symbol, loaded, covered):
+        """Merge loaded prices and their covered range into the cache."""
+        prices, ranges = self.entries.get(symbol, (None, []))
+        prices = loaded if prices is None else loaded.combine_first(prices)
+        self.remember(symbol, (prices, merge_ranges(ranges + [covered])))
+
+    def cache_info(self):
+        """Return hits, misses, cached symbols and memory use."""
+        info = LRUCache.cache_info(self)
+        info["symbols"] = len(self.entries)
+        return info
+
+
+def load_task(task):
+    """Call a price loader, task is (loader, symbol, start, end)."""
+    loader, symbol, start, end = task
+    return loader(symbol, start, end)
+
+
+def series_nbytes(series):
+    """Memory used by the values and the index of a Series or DataFrame."""
+    return series.values.nbytes + series.index.values.nbytes
+
+
+def atomic_write(path, write, suffix=".tmp"):
+    """Write a file through a temporary file that then replaces it, so
+    readers never see a partially written file.
+
+    Parameters
+    ----------
+        path: file to write
+        write: function write(tmp_path) writing the content to a path
+        suffix: suffix of the temporary file, in the directory of path
+    """
+    fd, tmp_file = tempfile.mkstemp(suffix=suffix, dir=os.path.dirname(path) or ".")
+    os.close(fd)
+    try:
+        write(tmp_file)
+        if os.name == "nt" and os.path.isfile(path):
+            os.remove(path) #rename does not overwrite on Windows
+        os.rename(tmp_file, path)
+    finally:
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+
+
+def merge_ranges(ranges):
+    """Merge overlapping or consecutive (start, end) date ranges."""
+    merged = []
+    for r_start, r_end in sorted(ranges):
+        if merged and r_start <= merged[-1][1] + pd.Timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], r_end))
+        else:
+            merged.append((r_start, r_end))
+    return merged
+
+
+#Prices already read by this process
+price_cache = PriceCache()
+
+#Date ranges whose download failed in this process, symbol -> ranges
+failed_syncs = {}
+
+#Business days a file may miss at the ends of a range (holidays) before
+#it is considered not to cover that range
+MAX_MISSING_BDAYS = 3
+
+
+def missing_bdays(start, end):
+    """Number of business days between start and end (inclusive)."""
+    if start > end:
+        return 0
+    return len(pd.bdate_range(start, end))
+
+
+def read_symbol(symbol):
+    """Read the adjusted close prices of a symbol from its CSV file."""
+    df_temp = pd.read_csv(symbol_to_path(symbol), index_col='Date',
+            parse_dates=True, usecols=['Date', 'Adj Close'], na_values=['nan'])
+    return df_temp['Adj Close'].sort_index()
+
+
+def load_symbol(symbol, start, end):
+    """Load adjusted close prices of a symbol covering start to end.
+
+    Prices are read from the price store if it is up to date, otherwise
+    from the CSV file. Dates missing from the CSV file are downloaded from
+    Yahoo! Finance and appended to it. If the download fails, a warning is
+    issued and the range is not downloaded again by this process.
+
+    Returns
+    -------
+        prices: Series with the prices of the symbol
+        covered: (start, end) range of dates the prices are known to cover
+    """
+    from pricestore import open_price_store
+    from datasync import sync_symbols
+    store = open_price_store()
+    if store is not None and store.has_symbols([symbol]):
+        prices = store.window(symbol, start, end)
+    elif os.path.isfile(symbol_to_path(symbol)):
+        prices = read_symbol(symbol)
+    else:
+        sync_symbols([symbol], start, end)
+        return read_symbol(symbol), (start, end)
+
+    #Fetch the gaps if the data does not span the requested dates
+    last_day = min(end, pd.Timestamp.today().normalize())
+    valid = prices.dropna().index
+    failed = any(f_start <= start and last_day <= f_end
+                 for f_start, f_end in failed_syncs.get(symbol, []))
+    if not failed and (len(valid) == 0
+            or missing_bdays(start, valid[0] - pd.Timedelta(days=1)) > MAX_MISSING_BDAYS
+            or missing_bdays(valid[-1] + pd.Timedelta(days=1), last_day) > MAX_MISSING_BDAYS):
+        try:
+            sync_symbols([symbol], start, last_day, tolerance=MAX_MISSING_BDAYS)
+            prices = read_symbol(symbol)
+        except Exception as e:
+            #The range is known to be missing, it is not downloaded again
+            #by this process and the cache serves it without the dates
+            failed_syncs[symbol] = merge_ranges(failed_syncs.get(symbol, []) + [(start, last_day)])
+            warnings.warn("Prices of {} do not cover {} to {}: {}".format(
+                symbol, start.date(), end.date(), e))
+
+    #Everything that was read is known, not only the requested dates
+    if len(prices) > 0:
+        start, end = min(start, prices.index[0]), max(end, prices.index[-1])
+    return prices, (start, end)
+
+
+def get_data(symbols, dates, addSPY=True, n_jobs=1, processes=False):
+    """Read stock data (adjusted close) for given symbols.
+
+    Prices are served from the in-process price cache, which loads them
+    from the price store or the CSV files when needed.
+
+    Parameters
+    ----------
+        symbols: ticker symbols to read
+        dates: dates to read
+        addSPY: add SPY for reference (default: True)
+        n_jobs: number of workers loading symbols that are not cached
+        processes: load with a process pool instead of threads
+
+    Returns
+    -------
+        df: DataFrame with one column per symbol, on the dates SPY traded
+        if SPY is among the symbols
     """
-    df = pd.DataFrame(index=dates)
     if addSPY and 'SPY' not in symbols:  # add SPY for reference, if absent
         symbols = ['SPY'] + symbols
+    if len(symbols) == 0:
+        return pd.DataFrame(index=dates)
 
-    for symbol in symbols:
-        #Check the csv file exist, otherwise download from Yahoo! Finance
-        #TODO: We should rewrite this code, if the file exists but with other dates
-        #it will fail
-        if not os.path.isfile( symbol_to_path(symbol) ):
-            date_init = dates[0].to_datetime()
-            date_end = dates[-1].to_datetime()
-            download_data(symbol, [date_init, date_end])
-        
-        #Read only dates and Adj Close column        
-        df_temp = pd.read_csv(symbol_to_path(symbol), index_col='Date',
-                parse_dates=True, usecols=['Date', 'Adj Close'], na_values=['nan'])
-        df_temp = df_temp.rename(columns={'Adj Close': symbol})
-        
-        #Join this symbol to the global data frame        
-        df = df.join(df_temp)
-        if symbol == 'SPY':  # drop dates SPY did not trade
-            df = df.dropna(subset=["SPY"])
+    prices = price_cache.get_many(symbols, dates[0], dates[-1], load_symbol, n_jobs, processes)
+
+    #Assemble all the symbols at once on the requested dates
+    df = pd.concat([p.rename(symbol) for symbol, p in zip(symbols, prices)], axis=1)
+    df = df.reindex(dates)
+    if 'SPY' in symbols:  # drop dates SPY did not trade
+        df = df.dropna(subset=["SPY"])
 
     return df
 
@@ -49,14 +311,10 @@ def plot_data(df, title="Stock prices", xlabel="Date", ylabel="Price", filename=
         plt.savefig(filename)
         
     plt.show()
-    
+
 
 def download_data(symbol, dates):
-    """Download historical prices from Yahoo Finance website and save
-    the data into CSV files."""
-    historical = pd.io.data.DataReader(symbol, 'yahoo', dates[0], dates[1])
-    historical.to_csv( symbol_to_path(symbol) )        
-    
-        
-    
-    
\ No newline at end of file
+    """Download historical prices from Yahoo Finance website into the CSV
+    file of a symbol, only the dates missing from the file are fetched."""
+    from datasync import sync_symbols
+    return sync_symbols([symbol], dates[0], dates[1])